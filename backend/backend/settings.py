@@ -29,6 +29,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'recipes.metrics.MetricsMiddleware',
+    'recipes.timing.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -138,6 +140,64 @@ DJOSER = {
     }
 }
 
+API_CACHE_MAX_AGE = int(os.getenv('API_CACHE_MAX_AGE', 60))
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+
+RANKING_SIZE = int(os.getenv('RANKING_SIZE', 500))
+
+# Локально — память процесса; в продакшене, например,
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache и
+# CACHE_LOCATION=redis://redis:6379/0 (нужен пакет redis).
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 60 * 60))
+# Кэш избранного, корзины и подписок пользователя между запросами; 0 —
+# выключен. Включать только с общим для воркеров кэшем (Redis, Memcached).
+RELATIONS_CACHE_TIMEOUT = int(os.getenv('RELATIONS_CACHE_TIMEOUT', 0))
+
+# Потоки для нарезки изображений рецептов; 0 — нарезать в самом запросе.
+# SQLite блокирует всю базу на запись, поэтому с ней по умолчанию 0.
+IMAGE_WORKERS = int(os.getenv(
+    'IMAGE_WORKERS',
+    0 if DATABASES['default']['ENGINE'].endswith('sqlite3') else 2
+))
+# Попыток записать готовые варианты, если база занята.
+IMAGE_SAVE_ATTEMPTS = int(os.getenv('IMAGE_SAVE_ATTEMPTS', 3))
+IMAGE_MAX_UPLOAD_SIZE = int(
+    os.getenv('IMAGE_MAX_UPLOAD_SIZE', 5 * 1024 * 1024)
+)
+
+# Время ответа, SQL и сериализации по каждому запросу: заголовок
+# Server-Timing и строка JSON в логгере recipes.timing. Запросы сверх
+# порогов пишутся с уровнем WARNING вместе с самыми частыми запросами.
+SERVER_TIMING_HEADER = (
+    os.getenv('SERVER_TIMING_HEADER', 'True').lower() == 'true'
+)
+SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', 30))
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 500))
+
+# /api/metrics/ в формате Prometheus. За gunicorn с несколькими воркерами
+# нужен общий для них каталог METRICS_DIR: каждый воркер раз в
+# METRICS_FLUSH_INTERVAL секунд пишет туда свои итоги.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1))
+METRICS_ALLOWED_NETWORKS = os.getenv(
+    'METRICS_ALLOWED_NETWORKS',
+    '127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16'
+).split(',')
+# Прокси, которым можно верить в X-Real-IP; по умолчанию никому.
+METRICS_TRUSTED_PROXIES = [
+    network for network in os.getenv('METRICS_TRUSTED_PROXIES', '').split(',')
+    if network
+]
+
 CSRF_TRUSTED_ORIGINS = [
     'https://jdk-foodgram.ddns.net',
     'http://localhost:8000'
@@ -152,9 +212,19 @@ LOGGING = {
             'class': 'logging.FileHandler',
             'filename': os.path.join(BASE_DIR, 'debug.log'),
         },
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
     },
     'root': {
         'handlers': ['file'],
         'level': 'ERROR',
     },
+    'loggers': {
+        'recipes.timing': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
 }
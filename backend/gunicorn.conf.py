@@ -0,0 +1,18 @@
+# gunicorn читает этот файл из рабочего каталога сам. Хуки выполняются в
+# мастере до загрузки Django, поэтому каталог метрик берётся прямо из
+# окружения, как и METRICS_DIR в settings.py.
+import os
+
+from recipes import metrics
+
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+
+
+def on_starting(server):
+    if METRICS_DIR:
+        metrics.clear_directory(METRICS_DIR)
+
+
+def child_exit(server, worker):
+    if METRICS_DIR:
+        metrics.archive_process(METRICS_DIR, worker.pid)
@@ -1,16 +1,31 @@
 from django import forms
 from django.contrib import admin
 
+from recipes import similarity
 from recipes.models import (
     Favorite,
     Ingredient,
     IngredientRecipe,
     Recipe,
+    RecipeRank,
     ShoppingCart,
+    ShoppingListItem,
     Tag,
+    relations_changed,
 )
 
 
+def rebuild_shopping_lists(recipe_ids):
+    # Списки покупок тех, у кого эти рецепты в корзине, после правок из
+    # админки проще пересобрать, чем вычислять разницу.
+    user_ids = set(
+        ShoppingCart.objects.filter(recipe_id__in=recipe_ids)
+        .values_list('user_id', flat=True)
+    )
+    if user_ids:
+        ShoppingListItem.objects.rebuild(user_ids)
+
+
 class RecipeAdminForm(forms.ModelForm):
     class Meta:
         model = Recipe
@@ -73,7 +88,9 @@ class IngredientRecipeInline(admin.TabularInline):
 class RecipeAdmin(admin.ModelAdmin):
     list_display = (
         'id', 'name', 'author', 'text', 'cooking_time', 'pub_date', 'image',
+        'favorite_count',
     )
+    readonly_fields = ('favorite_count',)
     list_filter = ('name', 'author', 'tags')
     ordering = ('-pub_date',)
     list_display_links = ('name',)
@@ -83,7 +100,16 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(description='Добавления в избранное')
     def favorite_count(self, recipe):
-        return recipe.favorites_recipe.count()
+        return recipe.favorites_count
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Ингредиенты правятся инлайном, их число и подпись проще
+        # пересчитать.
+        Recipe.objects.filter(pk=form.instance.pk).recount()
+        similarity.update([form.instance.pk])
+        if change:
+            rebuild_shopping_lists([form.instance.pk])
 
 
 @admin.register(IngredientRecipe)
@@ -92,9 +118,72 @@ class IngredientRecipeAdmin(admin.ModelAdmin):
     list_display_links = ('recipe',)
     search_fields = ('recipe',)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.recount([obj.recipe_id, form.initial.get('recipe')])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.recount([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = list(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self.recount(recipe_ids)
+
+    @staticmethod
+    def recount(recipe_ids):
+        recipe_ids = [recipe_id for recipe_id in recipe_ids if recipe_id]
+        Recipe.objects.filter(id__in=recipe_ids).recount()
+        similarity.update(recipe_ids)
+        rebuild_shopping_lists(recipe_ids)
+
 
 @admin.register(Favorite, ShoppingCart)
 class FavoriteShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'recipe')
     list_display_links = ('user',)
     search_fields = ('user',)
+
+    # Изменения из админки редки, поэтому счётчики затронутых рецептов и
+    # списки покупок затронутых пользователей просто пересчитываются.
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.recount(
+            [obj.recipe_id, form.initial.get('recipe')],
+            [obj.user_id, form.initial.get('user')]
+        )
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.recount([obj.recipe_id], [obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        rows = list(queryset.values_list('recipe_id', 'user_id'))
+        super().delete_queryset(request, queryset)
+        self.recount(
+            [recipe_id for recipe_id, _ in rows],
+            [user_id for _, user_id in rows]
+        )
+
+    def recount(self, recipe_ids, user_ids):
+        Recipe.objects.filter(id__in=recipe_ids).recount()
+        user_ids = {user_id for user_id in user_ids if user_id}
+        for user_id in user_ids:
+            relations_changed(self.model.content_version, user_id)
+        if self.model is ShoppingCart and user_ids:
+            ShoppingListItem.objects.rebuild(user_ids)
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'ingredient', 'amount')
+    list_display_links = ('user',)
+    search_fields = ('user__username',)
+
+
+@admin.register(RecipeRank)
+class RecipeRankAdmin(admin.ModelAdmin):
+    list_display = ('id', 'feed', 'position', 'recipe', 'score')
+    list_filter = ('feed',)
+    ordering = ('feed', 'position')
@@ -0,0 +1,61 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from . import metrics
+from .models import ContentVersion, Recipe
+
+# Меняется вместе с форматом закэшированного представления рецепта.
+SCHEMA_VERSION = 2
+
+_pending = threading.local()
+
+
+def cache_key(recipe):
+    return f'recipe:{SCHEMA_VERSION}:{recipe.pk}:{recipe.version}'
+
+
+def get_many(recipes, build):
+    # build получает рецепты, которых нет в кэше, и возвращает их
+    # представления в том же порядке.
+    keys = {cache_key(recipe): recipe for recipe in recipes}
+    payloads = cache.get_many(keys)
+    missing = [recipe for key, recipe in keys.items() if key not in payloads]
+    metrics.inc('cache_requests_total', ('recipe', 'hit'), len(payloads))
+    metrics.inc('cache_requests_total', ('recipe', 'miss'), len(missing))
+    if missing:
+        fresh = dict(zip(map(cache_key, missing), build(missing)))
+        cache.set_many(fresh, settings.RECIPE_CACHE_TIMEOUT)
+        payloads.update(fresh)
+    return [payloads[cache_key(recipe)] for recipe in recipes]
+
+
+def invalidate(recipe_ids=()):
+    # Версии поднимаются после коммита и раз на транзакцию: читатель,
+    # успевший взять старые данные, положит их под старой версией, и
+    # следующий запрос их уже не увидит. Без id (рецепт создан или
+    # удалён) меняются только валидаторы выдачи.
+    pending = getattr(_pending, 'ids', None)
+    if pending is None:
+        pending = _pending.ids = set()
+    pending.update(recipe_ids)
+    _pending.dirty = True
+    transaction.on_commit(flush)
+
+
+def flush():
+    if not getattr(_pending, 'dirty', False):
+        return
+    recipe_ids = _pending.ids
+    _pending.ids = set()
+    _pending.dirty = False
+    if recipe_ids:
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            version=F('version') + 1
+        )
+    # Валидаторы выдачи рецептов (ETag) меняются вместе с кэшем, каким бы
+    # путём ни менялся рецепт: API, админка, сигналы или фоновая задача.
+    ContentVersion.objects.bump('recipes')
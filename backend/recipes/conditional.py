@@ -0,0 +1,77 @@
+import hashlib
+
+from django.conf import settings
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+
+from .models import ContentVersion, user_content
+
+
+class ConditionalGetMixin:
+    versioned_content = ()
+    # Связи пользователя, от которых зависит ответ: их версии свои у
+    # каждого пользователя, и действия одних не сбрасывают валидаторы
+    # других.
+    per_user_content = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+    def conditional(self, handler, request, *args, **kwargs):
+        names = list(self.versioned_content)
+        if self.per_user_content and request.user.is_authenticated:
+            names.extend(
+                user_content(kind, request.user.pk)
+                for kind in self.per_user_content
+            )
+        versions = self.content_versions = (
+            ContentVersion.objects.current(names)
+        )
+        key = [
+            request.get_full_path(),
+            request.accepted_renderer.format,
+            *(
+                f'{name}:{versions[name].version}' if name in versions
+                else f'{name}:0'
+                for name in names
+            ),
+        ]
+        if self.per_user_content:
+            key.append(f'user:{request.user.pk}')
+        etag = quote_etag(
+            hashlib.md5('|'.join(key).encode()).hexdigest()
+        )
+        last_modified = max(
+            (
+                int(item.updated_at.timestamp())
+                for item in versions.values()
+            ),
+            default=None,
+        )
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(
+                response, public=True, max_age=settings.API_CACHE_MAX_AGE
+            )
+        return response
@@ -0,0 +1,48 @@
+import base64
+import binascii
+import io
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+from rest_framework import serializers
+
+
+class Base64ImageField(serializers.ImageField):
+    # Принимает то же, что и drf-base64: data:image/...;base64,... или
+    # голый base64, в том числе с переносами строк. Размер проверяется до
+    # декодирования, расширение файла берётся из самой картинки.
+    default_error_messages = {
+        'too_large': 'Размер изображения не должен превышать {max_size} байт.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = self.decode(data)
+        return super().to_internal_value(data)
+
+    def decode(self, data):
+        if data.startswith('data:'):
+            _, _, data = data.partition(';base64,')
+        payload = ''.join(data.split())
+        if not payload:
+            self.fail('invalid_image')
+
+        max_size = settings.IMAGE_MAX_UPLOAD_SIZE
+        if len(payload) // 4 * 3 > max_size + 2:
+            self.fail('too_large', max_size=max_size)
+        try:
+            decoded = base64.b64decode(payload, validate=True)
+        except binascii.Error:
+            self.fail('invalid_image')
+        if len(decoded) > max_size:
+            self.fail('too_large', max_size=max_size)
+
+        try:
+            image_format = Image.open(io.BytesIO(decoded)).format
+        except (OSError, ValueError):
+            self.fail('invalid_image')
+        return ContentFile(
+            decoded, name=f'{uuid.uuid4().hex}.{image_format.lower()}'
+        )
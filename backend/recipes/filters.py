@@ -1,21 +1,51 @@
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import OrderingFilter
 
+from . import search
 from .models import Recipe
 
 
+TAGS_MODE_ANY = 'any'
+TAGS_MODE_ALL = 'all'
+
+
 class RecipeFilter(filters.FilterSet):
+    tags = filters.CharFilter(method='filter_tags')
+    tags_mode = filters.ChoiceFilter(
+        choices=(
+            (TAGS_MODE_ANY, TAGS_MODE_ANY), (TAGS_MODE_ALL, TAGS_MODE_ALL)
+        ),
+        method='filter_tags_mode'
+    )
     is_favorited = filters.BooleanFilter(
         method='filter_is_favorited'
     )
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
         fields = {}
 
+    def filter_tags(self, queryset, name, value):
+        slugs = self.data.getlist('tags')
+        tags = Recipe.tags.through.objects
+        if self.form.cleaned_data.get('tags_mode') == TAGS_MODE_ALL:
+            for slug in set(slugs):
+                queryset = queryset.filter(Exists(
+                    tags.filter(recipe=OuterRef('pk'), tag__slug=slug)
+                ))
+            return queryset
+        return queryset.filter(Exists(
+            tags.filter(recipe=OuterRef('pk'), tag__slug__in=slugs)
+        ))
+
+    def filter_tags_mode(self, queryset, name, value):
+        return queryset
+
     def filter_is_favorited(self, queryset, name, value):
         if not self.request.user.is_authenticated:
             return queryset.none()
@@ -30,6 +60,22 @@ class RecipeFilter(filters.FilterSet):
             return queryset.filter(cart__user=self.request.user)
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        return search.search(queryset, value)
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    # id в конце делает порядок однозначным: на нём держатся и страницы,
+    # и курсоры KeysetPagination. При поиске без явного ?ordering= рецепты
+    # идут по релевантности.
+    def get_default_ordering(self, view):
+        query = view.request.query_params.get('search', '')
+        if search.terms(query):
+            return ('-search_rank',)
+        return super().get_default_ordering(view)
 
-class IngredientFilter(SearchFilter):
-    search_param = 'name'
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view))
+        if not {'id', '-id'} & set(ordering):
+            ordering.append('-id')
+        return tuple(ordering)
@@ -0,0 +1,147 @@
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import (
+    OperationalError,
+    close_old_connections,
+    transaction,
+)
+from PIL import Image, ImageOps
+
+from . import cache as recipe_cache
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Наибольшая сторона каждого варианта, px; меньшие картинки не
+# увеличиваются.
+RENDITIONS = (
+    ('thumbnail', 320),
+    ('card', 640),
+    ('full', 1280),
+)
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='recipe-images',
+        )
+    return _executor
+
+
+def schedule(recipe):
+    # Фоновая обработка стартует после коммита: воркер должен увидеть
+    # рецепт и файл исходника. IMAGE_WORKERS=0 — обрабатывать сразу, в той
+    # же транзакции: версия рецепта поднимется вместе с остальными
+    # изменениями, а экземпляр не затрёт варианты при повторном save().
+    recipe_id, source = recipe.pk, recipe.image.name
+    if settings.IMAGE_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(run, recipe_id, source)
+        )
+    else:
+        recipe.image_renditions = process(recipe_id, source)
+
+
+def run(recipe_id, source):
+    close_old_connections()
+    try:
+        process(recipe_id, source)
+    except Exception:
+        # Варианты остаются пустыми, их нарежет process_recipe_images.
+        logger.exception('Не удалось обработать изображение %s', source)
+    finally:
+        close_old_connections()
+
+
+def rendition_path(source, name, extension):
+    return f'{os.path.splitext(source)[0]}/{name}.{extension}'
+
+
+def process(recipe_id, source):
+    with default_storage.open(source) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    renditions = {'source': source}
+    for name, size in RENDITIONS:
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        renditions[name] = {}
+        for extension, image_format, options in FORMATS:
+            if image_format == 'JPEG' and resized.mode == 'RGBA':
+                output_image = Image.new('RGB', resized.size, 'white')
+                output_image.paste(resized, mask=resized.getchannel('A'))
+            else:
+                output_image = resized
+            output = io.BytesIO()
+            output_image.save(output, image_format, **options)
+            path = rendition_path(source, name, extension)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            renditions[name][extension] = default_storage.save(
+                path, ContentFile(output.getvalue())
+            )
+
+    if save_renditions(recipe_id, source, renditions):
+        recipe_cache.invalidate([recipe_id])
+    return renditions
+
+
+def save_renditions(recipe_id, source, renditions):
+    # Если картинку успели заменить, варианты старой не записываются.
+    # Занятая база (SQLite во время чужой транзакции) — повод подождать и
+    # повторить, а не терять уже нарезанные файлы.
+    attempts = settings.IMAGE_SAVE_ATTEMPTS
+    for attempt in range(1, attempts + 1):
+        try:
+            return Recipe.objects.filter(pk=recipe_id, image=source).update(
+                image_renditions=renditions
+            )
+        except OperationalError:
+            if attempt == attempts:
+                raise
+            time.sleep(0.1 * 2 ** attempt)
+
+
+def needs_processing(recipe):
+    return bool(recipe.image) and (
+        recipe.image_renditions.get('source') != recipe.image.name
+    )
+
+
+def rendition_urls(recipe, request=None):
+    # Пока варианты не готовы, отдаётся None, и клиент берёт image.
+    if needs_processing(recipe) or not recipe.image:
+        return None
+    return {
+        name: {
+            extension: url(recipe.image_renditions[name][extension], request)
+            for extension, _, _ in FORMATS
+        }
+        for name, _ in RENDITIONS
+    }
+
+
+def url(path, request=None):
+    location = default_storage.url(path)
+    if request is not None:
+        return request.build_absolute_uri(location)
+    return location
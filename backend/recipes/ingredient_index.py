@@ -0,0 +1,73 @@
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .models import ContentVersion, Ingredient
+
+
+def normalize(value):
+    return value.strip().casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    # Индекс привязан к версии ContentVersion('ingredients'): её поднимают
+    # сигналы Ingredient и import_ingredients, так что каждый воркер
+    # перестраивает свою копию при первом запросе после изменения.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = None
+        self._items = None
+        self._version = None
+
+    def _load(self, version):
+        with self._lock:
+            if self._keys is None or self._version != version:
+                entries = sorted(
+                    (
+                        normalize(name),
+                        {
+                            'id': pk,
+                            'name': name,
+                            'measurement_unit': measurement_unit,
+                        },
+                    )
+                    for pk, name, measurement_unit in Ingredient.objects
+                    .values_list('id', 'name', 'measurement_unit')
+                    .iterator()
+                )
+                self._keys = [key for key, _ in entries]
+                self._items = [item for _, item in entries]
+                self._version = version
+            return self._keys, self._items
+
+    def search(self, query, version=None, limit=None):
+        if version is None:
+            version = ContentVersion.objects.filter(
+                name='ingredients'
+            ).values_list('version', flat=True).first() or 0
+        keys, items = self._load(version)
+        query = normalize(query)
+        if not query:
+            return items
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+
+        result = []
+        position = bisect_left(keys, query)
+        while (
+            position < len(keys)
+            and keys[position].startswith(query)
+            and len(result) < limit
+        ):
+            result.append(items[position])
+            position += 1
+
+        for key, item in zip(keys, items):
+            if len(result) >= limit:
+                break
+            if query in key and not key.startswith(query):
+                result.append(item)
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,443 @@
+import csv
+import logging
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from rest_framework.test import APIClient
+
+from recipes import ranking, similarity
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    RecipeSearchDocument,
+    ShoppingCart,
+    Tag,
+)
+from users.models import Follow, User
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+BATCH_SIZE = 1000
+
+# Маршрут -> (максимум SQL-запросов, максимум миллисекунд).
+BUDGETS = {
+    'recipes-list': (3, 300),
+    'recipes-list-deep-page': (3, 300),
+    'recipes-list-cursor': (2, 300),
+    'recipes-list-popular': (2, 300),
+    'recipes-popular': (3, 300),
+    'recipes-trending-cursor': (2, 300),
+    'recipes-list-filtered': (3, 300),
+    'recipes-search': (3, 300),
+    'recipes-what-to-cook': (3, 300),
+    'recipes-similar': (7, 300),
+    'recipes-detail': (2, 200),
+    'recipes-create': (29, 500),
+    'recipes-update': (34, 500),
+    'recipes-favorite-add': (3, 200),
+    'recipes-favorite-remove': (3, 200),
+    'recipes-shopping-cart-add': (7, 200),
+    'recipes-shopping-cart-remove': (8, 200),
+    'recipes-download-shopping-cart': (1, 300),
+    'tags-list': (2, 100),
+    'ingredients-search': (1, 200),
+    'users-list': (3, 300),
+    'users-subscriptions': (3, 500),
+    'recipes-favorite-bulk-add': (8, 300),
+    'recipes-favorite-bulk-remove': (8, 300),
+    'recipes-shopping-cart-bulk-add': (10, 300),
+    'recipes-shopping-cart-bulk-remove': (11, 300),
+    'users-subscribe': (9, 300),
+    'users-unsubscribe': (7, 200),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер числа SQL-запросов и времени ответа API на тестовых данных. '
+        'Завершается ошибкой при превышении бюджета'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--no-timing',
+            action='store_true',
+            help='Проверять только число запросов',
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.repeat = max(options['repeat'], 1)
+
+        # Свою таблицу команда печатает сама, строки RequestTimingMiddleware
+        # по каждому запросу ей не нужны.
+        logging.getLogger('recipes.timing').setLevel(logging.ERROR)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            with tempfile.TemporaryDirectory() as media_root:
+                # Изображения нарезаются в самом запросе: фоновый поток
+                # упирался бы в блокировку SQLite, а его запросы не
+                # попадали бы в бюджет.
+                with override_settings(
+                    MEDIA_ROOT=media_root, IMAGE_WORKERS=0
+                ):
+                    started = time.perf_counter()
+                    user = self.seed(options['users'], options['recipes'])
+                    self.stdout.write(
+                        'Данные сгенерированы за '
+                        f'{time.perf_counter() - started:.1f} с'
+                    )
+                    results = self.run_routes(user)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        failures = self.report(results, options['no_timing'])
+        if failures:
+            raise CommandError(
+                'Превышен бюджет: ' + ', '.join(failures)
+            )
+        self.stdout.write(self.style.SUCCESS('Все бюджеты соблюдены'))
+
+    def seed(self, users_count, recipes_count):
+        rnd = self.random
+        file_path = os.path.join(
+            os.path.abspath(
+                os.path.join(settings.BASE_DIR, os.pardir)
+            ), 'data', 'ingredients.csv'
+        )
+        with open(file_path, 'r', encoding='utf-8') as file:
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(name=name, measurement_unit=unit)
+                    for name, unit in csv.reader(file)
+                ),
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+
+        tags = Tag.objects.bulk_create(
+            Tag(name=name, slug=slug, color=color)
+            for name, slug, color in (
+                ('Завтрак', 'breakfast', '#E26C2D'),
+                ('Обед', 'lunch', '#49B64E'),
+                ('Ужин', 'dinner', '#8775D2'),
+            )
+        )
+
+        users = User.objects.bulk_create(
+            (
+                User(
+                    email=f'user{i}@example.com',
+                    username=f'user{i}',
+                    first_name='Имя',
+                    last_name='Фамилия',
+                    password='!',
+                )
+                for i in range(users_count)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        user_ids = [user.id for user in users]
+
+        recipes = Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    name=f'Рецепт {i}',
+                    text='Описание рецепта',
+                    image='recipes/images/benchmark.png',
+                    author_id=rnd.choice(user_ids),
+                    cooking_time=rnd.randint(5, 120),
+                )
+                for i in range(recipes_count)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        recipe_ids = [recipe.id for recipe in recipes]
+
+        # Каждый второй рецепт — вариация предыдущего с ещё одним
+        # ингредиентом: иначе у похожих рецептов не нашлось бы кандидатов.
+        compositions = []
+        for index in range(len(recipe_ids)):
+            composition = rnd.sample(ingredient_ids, rnd.randint(3, 12))
+            if index % 2:
+                composition = compositions[-1] + [
+                    ingredient_id for ingredient_id in composition
+                    if ingredient_id not in compositions[-1]
+                ][:1]
+            compositions.append(composition)
+        IngredientRecipe.objects.bulk_create(
+            (
+                IngredientRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=rnd.randint(1, 500),
+                )
+                for recipe_id, composition in zip(recipe_ids, compositions)
+                for ingredient_id in composition
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag.id)
+                for recipe_id in recipe_ids
+                for tag in rnd.sample(tags, rnd.randint(1, len(tags)))
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+        for model, per_user in (
+            (Favorite, 10), (ShoppingCart, 3)
+        ):
+            model.objects.bulk_create(
+                (
+                    model(user_id=user_id, recipe_id=recipe_id)
+                    for user_id in user_ids
+                    for recipe_id in rnd.sample(
+                        recipe_ids, min(per_user, len(recipe_ids))
+                    )
+                ),
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+        Follow.objects.bulk_create(
+            (
+                Follow(user_id=user_id, author_id=author_id)
+                for user_id in user_ids
+                for author_id in rnd.sample(user_ids, min(5, len(user_ids)))
+                if author_id != user_id
+            ),
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+        # Самый «тяжёлый» пользователь: большая корзина и много подписок.
+        user = users[0]
+        ShoppingCart.objects.bulk_create(
+            (
+                ShoppingCart(user=user, recipe_id=recipe_id)
+                for recipe_id in rnd.sample(
+                    recipe_ids, min(30, len(recipe_ids))
+                )
+            ),
+            ignore_conflicts=True,
+        )
+        Follow.objects.bulk_create(
+            (
+                Follow(user=user, author_id=author_id)
+                for author_id in rnd.sample(
+                    user_ids[1:], min(30, len(user_ids) - 1)
+                )
+            ),
+            ignore_conflicts=True,
+        )
+        Recipe.objects.recount()
+        RecipeSearchDocument.objects.rebuild()
+        similarity.update(recipe_ids)
+        for feed in ranking.FEEDS:
+            ranking.refresh(feed)
+        return user
+
+    def run_routes(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+
+        recipe = Recipe.objects.exclude(author=user).exclude(
+            favorites__user=user
+        ).exclude(cart__user=user).first()
+        author = User.objects.exclude(id=user.id).exclude(
+            following__user=user
+        ).first()
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        ingredient_ids = list(
+            Ingredient.objects.values_list('id', flat=True)[:10]
+        )
+        payload = {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': tag_ids,
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10}
+                for ingredient_id in ingredient_ids
+            ],
+        }
+        pages = Recipe.objects.count() // settings.REST_FRAMEWORK['PAGE_SIZE']
+
+        reads = (
+            ('recipes-list', '/api/recipes/'),
+            ('recipes-list-deep-page', f'/api/recipes/?page={pages}'),
+            ('recipes-list-cursor', '/api/recipes/?cursor='),
+            (
+                'recipes-list-popular',
+                '/api/recipes/?ordering=-favorites_count',
+            ),
+            ('recipes-popular', '/api/recipes/popular/'),
+            ('recipes-trending-cursor', '/api/recipes/trending/?cursor='),
+            (
+                'recipes-list-filtered',
+                '/api/recipes/?tags=breakfast&tags=lunch&is_favorited=1',
+            ),
+            ('recipes-search', '/api/recipes/?search=рецепт 12'),
+            (
+                'recipes-what-to-cook',
+                '/api/recipes/what_to_cook/?ingredients='
+                + ','.join(map(str, ingredient_ids)),
+            ),
+            ('recipes-similar', f'/api/recipes/{recipe.id}/similar/'),
+            ('recipes-detail', f'/api/recipes/{recipe.id}/'),
+            (
+                'recipes-download-shopping-cart',
+                '/api/recipes/download_shopping_cart/',
+            ),
+            ('tags-list', '/api/tags/'),
+            ('ingredients-search', '/api/ingredients/?name=мо'),
+            ('users-list', '/api/users/'),
+            (
+                'users-subscriptions',
+                '/api/users/subscriptions/?recipes_limit=3',
+            ),
+        )
+        results = []
+        for name, url in reads:
+            results.append(
+                self.measure(name, lambda url=url: client.get(url))
+            )
+
+        created = self.measure(
+            'recipes-create',
+            lambda: client.post('/api/recipes/', payload, format='json'),
+            repeat=1,
+        )
+        results.append(created)
+        new_id = created['response'].json()['id']
+        results.append(self.measure(
+            'recipes-update',
+            lambda: client.patch(
+                f'/api/recipes/{new_id}/',
+                {**payload, 'ingredients': payload['ingredients'][:5]},
+                format='json',
+            ),
+            repeat=1,
+        ))
+
+        for name, url in (
+            ('recipes-favorite', f'/api/recipes/{recipe.id}/favorite/'),
+            (
+                'recipes-shopping-cart',
+                f'/api/recipes/{recipe.id}/shopping_cart/',
+            ),
+        ):
+            results.append(self.measure(
+                f'{name}-add', lambda url=url: client.post(url), repeat=1
+            ))
+            results.append(self.measure(
+                f'{name}-remove', lambda url=url: client.delete(url), repeat=1
+            ))
+
+        bulk_ids = {'ids': list(
+            Recipe.objects.exclude(favorites__user=user)
+            .exclude(cart__user=user)
+            .values_list('id', flat=True)[:20]
+        )}
+        for name, url in (
+            ('recipes-favorite-bulk', '/api/recipes/favorite/'),
+            ('recipes-shopping-cart-bulk', '/api/recipes/shopping_cart/'),
+        ):
+            results.append(self.measure(
+                f'{name}-add',
+                lambda url=url: client.post(url, bulk_ids, format='json'),
+                repeat=1,
+            ))
+            results.append(self.measure(
+                f'{name}-remove',
+                lambda url=url: client.delete(url, bulk_ids, format='json'),
+                repeat=1,
+            ))
+
+        url = f'/api/users/{author.id}/subscribe/'
+        results.append(self.measure(
+            'users-subscribe', lambda: client.post(url), repeat=1
+        ))
+        results.append(self.measure(
+            'users-unsubscribe', lambda: client.delete(url), repeat=1
+        ))
+        return results
+
+    def measure(self, name, call, repeat=None):
+        timings = []
+        for _ in range(repeat or self.repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = call()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{name}: статус {response.status_code} '
+                f'{response.content[:200]!r}'
+            )
+        return {
+            'name': name,
+            'response': response,
+            'queries': queries.captured_queries,
+            'ms': statistics.median(timings),
+        }
+
+    def report(self, results, no_timing):
+        failures = []
+        self.stdout.write(
+            f'{"маршрут":<32}{"запросы":>10}{"бюджет":>8}'
+            f'{"мс":>10}{"бюджет":>8}'
+        )
+        for result in results:
+            max_queries, max_ms = BUDGETS[result['name']]
+            queries = len(result['queries'])
+            failed = queries > max_queries or (
+                not no_timing and result['ms'] > max_ms
+            )
+            line = (
+                f'{result["name"]:<32}{queries:>10}{max_queries:>8}'
+                f'{result["ms"]:>10.1f}{max_ms:>8}'
+            )
+            if not failed:
+                self.stdout.write(line)
+                continue
+
+            failures.append(result['name'])
+            self.stdout.write(self.style.ERROR(line))
+            repeated = {}
+            for query in result['queries']:
+                sql = re.sub(r'\b\d+\b', '?', query['sql'])
+                repeated[sql] = repeated.get(sql, 0) + 1
+            for sql, count in sorted(
+                repeated.items(), key=lambda item: -item[1]
+            )[:3]:
+                self.stdout.write(f'    {count}x {sql[:150]}')
+        return failures
@@ -0,0 +1,159 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from recipes import ranking
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeBucket,
+    ShoppingCart,
+    ShoppingListItem,
+    Tag,
+)
+from recipes.views import RecipeViewSet
+from users.models import Follow, User
+from users.views import SubscriptionsView
+
+SEQ_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    # FTS5-таблица читается своим индексом: SCAN ... VIRTUAL TABLE INDEX.
+    'sqlite': re.compile(r'\bSCAN (\w+)(?!.*\b(?:USING|VIRTUAL TABLE)\b)'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN основных запросов API на текущей БД с поиском '
+        'полных просмотров таблиц'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, help='id пользователя для запросов'
+        )
+        parser.add_argument(
+            '--fail', action='store_true',
+            help='Завершаться ошибкой при найденном полном просмотре',
+        )
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Печатать планы целиком',
+        )
+
+    def handle(self, *args, **options):
+        pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f'СУБД {connection.vendor} не поддерживается')
+
+        user = (
+            User.objects.get(id=options['user']) if options['user']
+            else User.objects.order_by('id').first()
+        )
+        if user is None:
+            raise CommandError('В базе нет пользователей')
+        self.factory = APIRequestFactory()
+
+        flagged = []
+        for name, queryset in self.queries(user):
+            plan = queryset.explain()
+            tables = sorted(set(pattern.findall(plan)))
+            if tables:
+                flagged.append(name)
+                self.stdout.write(self.style.WARNING(
+                    f'{name}: полный просмотр {", ".join(tables)}'
+                ))
+            else:
+                self.stdout.write(f'{name}: ok')
+            if options['verbose_plans'] or tables:
+                for line in plan.splitlines():
+                    self.stdout.write(f'    {line}')
+
+        if flagged and options['fail']:
+            raise CommandError(
+                'Полный просмотр таблиц: ' + ', '.join(flagged)
+            )
+        if flagged:
+            self.stdout.write(
+                'На маленьких таблицах планировщик может предпочесть полный '
+                'просмотр индексу; проверяйте на данных, близких к боевым.'
+            )
+
+    def view_queryset(self, view_class, url, user, **view_kwargs):
+        request = Request(self.factory.get(url))
+        request.user = user
+        view = view_class(
+            request=request,
+            action='list',
+            args=(),
+            kwargs={},
+            format_kwarg=None,
+            **view_kwargs,
+        )
+        queryset = view.get_queryset()
+        if hasattr(view, 'filter_queryset'):
+            queryset = view.filter_queryset(queryset)
+        return queryset
+
+    def queries(self, user):
+        recipe = Recipe.objects.order_by('-pub_date').first()
+        tag = Tag.objects.first()
+        recipes = '/api/recipes/'
+
+        yield 'recipes-list', self.view_queryset(
+            RecipeViewSet, recipes, user
+        )[:6]
+        yield 'recipes-list-popular', self.view_queryset(
+            RecipeViewSet, f'{recipes}?ordering=-favorites_count', user
+        )[:6]
+        for feed in ranking.FEEDS:
+            yield f'recipes-{feed}', self.view_queryset(
+                RecipeViewSet, recipes, user
+            ).ranked(feed)[:6]
+        yield 'recipes-list-author', self.view_queryset(
+            RecipeViewSet, f'{recipes}?author={user.id}', user
+        )[:6]
+        if tag is not None:
+            yield 'recipes-list-tags', self.view_queryset(
+                RecipeViewSet, f'{recipes}?tags={tag.slug}', user
+            )[:6]
+        yield 'recipes-list-search', self.view_queryset(
+            RecipeViewSet, f'{recipes}?search=рецепт', user
+        )[:6]
+        yield 'recipes-what-to-cook', self.view_queryset(
+            RecipeViewSet, recipes, user
+        ).cookable(
+            Ingredient.objects.values_list('id', flat=True)[:10]
+        )[:6]
+        yield 'recipes-similar-candidates', RecipeBucket.objects.filter(
+            band=0, bucket=0
+        ).values('recipe_id')
+        yield 'recipes-list-favorited', self.view_queryset(
+            RecipeViewSet, f'{recipes}?is_favorited=1', user
+        )[:6]
+        yield 'recipes-list-in-cart', self.view_queryset(
+            RecipeViewSet, f'{recipes}?is_in_shopping_cart=1', user
+        )[:6]
+        if recipe is not None:
+            yield 'recipes-detail', self.view_queryset(
+                RecipeViewSet, recipes, user
+            ).filter(pk=recipe.pk)
+            yield 'recipes-favorites-of-recipe', Favorite.objects.filter(
+                recipe=recipe
+            )
+            yield 'recipes-carts-of-recipe', ShoppingCart.objects.filter(
+                recipe=recipe
+            )
+        yield 'recipes-download-shopping-cart', (
+            ShoppingListItem.objects.filter(user=user)
+            .values('ingredient__name', 'ingredient__measurement_unit')
+            .order_by('ingredient__name')
+        )
+        yield 'users-subscriptions', self.view_queryset(
+            SubscriptionsView, '/api/users/subscriptions/', user
+        )[:6]
+        yield 'users-followers', Follow.objects.filter(author=user)
@@ -1,33 +1,181 @@
-import os
 import csv
+import json
+import os
+import time
+from itertools import islice
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ContentVersion, Ingredient, IngredientRecipe
+from recipes.signals import recipes_changed
+
+HEADER = ('name', 'measurement_unit')
+CHUNK_SIZE = 64 * 1024
 
-from recipes.models import Ingredient
+
+def iter_json_array(file, chunk_size=CHUNK_SIZE):
+    # Элементы массива верхнего уровня по одному: файл читается кусками,
+    # а не загружается в память целиком.
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    opened = False
+    while True:
+        buffer = buffer.lstrip()
+        if not opened and buffer:
+            if buffer[0] != '[':
+                raise CommandError('Ожидался JSON-массив ингредиентов')
+            buffer, opened = buffer[1:], True
+            continue
+        if buffer.startswith(','):
+            buffer = buffer[1:]
+            continue
+        if buffer.startswith(']'):
+            return
+        if buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise CommandError('Некорректный JSON')
+            else:
+                # Элемент на границе куска мог прочитаться не целиком.
+                if end < len(buffer) or eof:
+                    yield item
+                    buffer = buffer[end:]
+                    continue
+        if eof:
+            raise CommandError('Некорректный JSON')
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
 
 
 class Command(BaseCommand):
     help = 'Импорт ингредиентов в БД'
 
-    def handle(self, *args, **options):
-        Ingredient.objects.all().delete()
-        file_path = os.path.join(
-            os.path.abspath(
-                os.path.join(settings.BASE_DIR, os.pardir)
-            ), 'data', 'ingredients.csv'
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=os.path.join(
+                os.path.abspath(
+                    os.path.join(settings.BASE_DIR, os.pardir)
+                ), 'data', 'ingredients.csv'
+            ),
+            help='Файл .csv (name,measurement_unit) или .json',
         )
-        with open(file_path, 'r', encoding='utf-8') as file:
-            csv_reader = csv.reader(file)
-            next(csv_reader)
-
-            for row in csv_reader:
-                name, measurement_unit = row
-                ingredient, created = Ingredient.objects.get_or_create(
-                    name=name,
-                    defaults={'measurement_unit': measurement_unit}
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Посчитать изменения, ничего не записывая в БД',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'Файл не найден: {path}')
+
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+        seen = set()
+        recipe_ids = set()
+        started = time.perf_counter()
+        with open(path, 'r', encoding='utf-8') as file:
+            rows = self.read_rows(file, path)
+            while True:
+                batch = []
+                for name, measurement_unit in islice(
+                    rows, options['batch_size']
+                ):
+                    if not name or name in seen:
+                        counts['skipped'] += 1
+                        continue
+                    seen.add(name)
+                    batch.append((name, measurement_unit))
+                if not batch:
+                    break
+                self.import_batch(
+                    batch, counts, recipe_ids, options['dry_run']
                 )
 
+        changed = counts['inserted'] or counts['updated']
+        if changed and not options['dry_run']:
+            # bulk_create не шлёт сигналов: кэш и валидаторы рецептов с
+            # изменёнными ингредиентами сбрасываются здесь.
+            with transaction.atomic():
+                ContentVersion.objects.bump('ingredients')
+                recipes_changed(recipe_ids)
+
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
         self.stdout.write(
-            self.style.SUCCESS('Ингредиенты успешно импортированы')
+            self.style.SUCCESS(
+                f'Ингредиенты успешно импортированы'
+                f'{" (пробный запуск)" if options["dry_run"] else ""}: '
+                f'добавлено {counts["inserted"]}, '
+                f'обновлено {counts["updated"]}, '
+                f'без изменений {counts["unchanged"]}, '
+                f'пропущено {counts["skipped"]}; '
+                f'{total / elapsed if elapsed else total:.0f} строк/с'
+            )
+        )
+
+    def read_rows(self, file, path):
+        if path.endswith('.json'):
+            for item in iter_json_array(file):
+                try:
+                    yield (
+                        item['name'].strip(),
+                        item['measurement_unit'].strip(),
+                    )
+                except (TypeError, KeyError, AttributeError):
+                    yield '', ''
+            return
+
+        for row in csv.reader(file):
+            if tuple(row) == HEADER:
+                continue
+            if len(row) != 2:
+                # Битая строка попадёт в счётчик пропущенных.
+                yield '', ''
+                continue
+            yield row[0].strip(), row[1].strip()
+
+    def import_batch(self, batch, counts, recipe_ids, dry_run):
+        existing = {
+            name: (pk, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.filter(
+                name__in=[name for name, _ in batch]
+            ).values_list('id', 'name', 'measurement_unit')
+        }
+        changed = []
+        updated_ids = []
+        for name, measurement_unit in batch:
+            if name not in existing:
+                counts['inserted'] += 1
+            elif existing[name][1] != measurement_unit:
+                counts['updated'] += 1
+                updated_ids.append(existing[name][0])
+            else:
+                counts['unchanged'] += 1
+                continue
+            changed.append(
+                Ingredient(name=name, measurement_unit=measurement_unit)
+            )
+
+        if dry_run or not changed:
+            return
+        with transaction.atomic():
+            Ingredient.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=['name'],
+                update_fields=['measurement_unit'],
+            )
+        recipe_ids.update(
+            IngredientRecipe.objects.filter(ingredient_id__in=updated_ids)
+            .values_list('recipe_id', flat=True)
         )
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+
+from recipes import images
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Нарезка уменьшенных копий изображений рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересоздать копии и для уже обработанных рецептов'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        processed = 0
+        recipes = Recipe.objects.exclude(image='').only(
+            'id', 'image', 'image_renditions'
+        )
+        pending = [
+            recipe for recipe in recipes.iterator()
+            if options['all'] or images.needs_processing(recipe)
+        ]
+        # Рецепты, которые не удалось обработать (например, база была
+        # занята), ставятся в конец очереди ещё на одну попытку.
+        for _ in range(2):
+            failed = []
+            for recipe in pending:
+                try:
+                    images.process(recipe.pk, recipe.image.name)
+                except (OSError, ValueError, OperationalError) as error:
+                    failed.append(recipe)
+                    self.stderr.write(f'Рецепт {recipe.pk}: {error}')
+                    continue
+                processed += 1
+            pending = failed
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {processed}, с ошибками: '
+            f'{len(pending)}; '
+            f'{processed / elapsed if elapsed else processed:.1f} в секунду'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import RecipeSearchDocument
+
+
+class Command(BaseCommand):
+    help = 'Пересборка поисковых документов рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipe', type=int, action='append', dest='recipe_ids',
+            help='id рецепта; можно указать несколько раз'
+        )
+
+    def handle(self, *args, **options):
+        count = RecipeSearchDocument.objects.rebuild(options['recipe_ids'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Поисковые документы пересобраны: {count}')
+        )
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes import similarity
+from recipes.models import ContentVersion, Recipe
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт MinHash-подписей и корзин LSH для похожих рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Рецептов в одной транзакции'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipe_ids = list(
+            Recipe.objects.order_by('id').values_list('id', flat=True)
+        )
+        started = time.perf_counter()
+        count = 0
+        for start in range(0, len(recipe_ids), batch_size):
+            count += similarity.update(recipe_ids[start:start + batch_size])
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{min(start + batch_size, len(recipe_ids))}'
+                f'/{len(recipe_ids)} рецептов, '
+                f'{count / elapsed if elapsed else 0:.0f} рецептов/с'
+            )
+        # Закэшированные ответы /similar/ не должны отдаваться с 304.
+        ContentVersion.objects.bump('recipes')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Подписей: {count} за {elapsed:.2f} с '
+            f'({count / elapsed if elapsed else 0:.0f} рецептов/с)'
+        ))
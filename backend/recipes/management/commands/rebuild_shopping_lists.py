@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт сохранённых списков покупок из корзин пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='user_ids',
+            help='id пользователя; можно указать несколько раз'
+        )
+
+    def handle(self, *args, **options):
+        count = ShoppingListItem.objects.rebuild(options['user_ids'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Списки покупок пересчитаны: {count} строк')
+        )
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from recipes.models import ContentVersion, Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверка счётчиков избранного, списков покупок и ингредиентов '
+        'рецептов с фактическим числом строк'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения, ничего не исправляя',
+        )
+
+    def handle(self, *args, **options):
+        stale = list(
+            Recipe.objects.with_actual_counters()
+            .filter(
+                ~Q(favorites_count=F('actual_favorites_count'))
+                | ~Q(in_carts_count=F('actual_in_carts_count'))
+                | ~Q(ingredients_count=F('actual_ingredients_count'))
+            )
+            .values_list(
+                'id', 'favorites_count', 'actual_favorites_count',
+                'in_carts_count', 'actual_in_carts_count',
+                'ingredients_count', 'actual_ingredients_count',
+            )
+            .order_by('id')
+        )
+        for (
+            recipe_id, favorites, actual_favorites, carts, actual_carts,
+            ingredients, actual_ingredients
+        ) in stale:
+            self.stdout.write(
+                f'Рецепт {recipe_id}: избранное {favorites} -> '
+                f'{actual_favorites}, списки покупок {carts} -> '
+                f'{actual_carts}, ингредиенты {ingredients} -> '
+                f'{actual_ingredients}'
+            )
+
+        if stale and not options['dry_run']:
+            Recipe.objects.filter(id__in=[row[0] for row in stale]).recount()
+            ContentVersion.objects.bump('recipes')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Расхождений: {len(stale)}'
+                f'{" (пробный запуск)" if options["dry_run"] else ""}'
+            )
+        )
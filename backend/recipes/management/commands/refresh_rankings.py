@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes import ranking
+from recipes.models import RecipeRank
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчёт подборок «популярное» и «в тренде»; '
+        'запускается по расписанию (cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--feed', action='append', dest='feeds',
+            choices=[feed for feed, _ in RecipeRank.FEEDS],
+            help='Подборка; по умолчанию все'
+        )
+        parser.add_argument(
+            '--size', type=int, help='Число рецептов в подборке'
+        )
+
+    def handle(self, *args, **options):
+        for feed in options['feeds'] or ranking.FEEDS:
+            started = time.perf_counter()
+            count = ranking.refresh(feed, options['size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'{feed}: {count} рецептов '
+                f'за {time.perf_counter() - started:.2f} с'
+            ))
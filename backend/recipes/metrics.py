@@ -0,0 +1,317 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+
+PREFIX = 'foodgram_'
+ARCHIVE_NAME = 'archive.json'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# Имя -> (тип, описание, имена меток, границы корзин гистограммы).
+METRICS = {
+    'http_requests_total': (
+        'counter', 'Запросы к API', ('route', 'method', 'status'), None
+    ),
+    'http_errors_total': (
+        'counter', 'Ответы с кодом 5xx', ('route', 'method', 'status'), None
+    ),
+    'http_exceptions_total': (
+        'counter', 'Необработанные исключения', ('route', 'exception'), None
+    ),
+    'http_request_duration_seconds': (
+        'histogram', 'Время ответа', ('route', 'method'), DURATION_BUCKETS
+    ),
+    'http_request_db_queries': (
+        'histogram', 'SQL-запросов на запрос', ('route', 'method'),
+        QUERY_BUCKETS
+    ),
+    'cache_requests_total': (
+        'counter', 'Обращения к кэшу', ('cache', 'result'), None
+    ),
+}
+
+
+class Registry:
+    # Значения копятся в памяти процесса. С METRICS_DIR каждый воркер
+    # gunicorn периодически сбрасывает свои накопленные итоги в отдельный
+    # файл, а /api/metrics/ складывает файлы всех воркеров. Итоги
+    # завершившихся воркеров мастер переносит в archive.json, чтобы
+    # счётчики не уменьшались (см. gunicorn.conf.py).
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.reset()
+
+    def reset(self):
+        self.values = defaultdict(float)
+        self.histograms = {}
+        self.path = None
+        self.flushed_at = 0.0
+
+    def check_pid(self):
+        # После fork у дочернего процесса свой файл и свои итоги.
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.check_pid()
+            self.values[name, labels] += value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][3]
+        with self.lock:
+            self.check_pid()
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[name, labels] = {
+                    'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0
+                }
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            self.check_pid()
+            return {
+                'values': [
+                    [name, list(labels), value]
+                    for (name, labels), value in self.values.items()
+                ],
+                'histograms': [
+                    [name, list(labels), dict(histogram, buckets=list(
+                        histogram['buckets']
+                    ))]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+    def flush(self, force=False):
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self.flushed_at < (
+            settings.METRICS_FLUSH_INTERVAL
+        ):
+            return
+        data = self.snapshot()
+        self.flushed_at = now
+        if self.path is None:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+            self.path = Path(directory) / (
+                f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+            )
+        write_json(self.path, data)
+
+
+registry = Registry()
+
+
+def write_json(path, data):
+    # Свой временный файл у каждого вызова: потоки одного воркера могут
+    # сбрасывать итоги одновременно.
+    descriptor, temporary = tempfile.mkstemp(
+        dir=path.parent, prefix=f'.{path.stem}-', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(data, file)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def read_json(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        # Файл мог исчезнуть при переносе в архив.
+        return None
+
+
+def merge(snapshots):
+    values = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['values']:
+            values[name, tuple(labels)] += value
+        for name, labels, histogram in snapshot['histograms']:
+            total = histograms.setdefault((name, tuple(labels)), {
+                'buckets': [0] * len(histogram['buckets']),
+                'sum': 0.0,
+                'count': 0,
+            })
+            for index, count in enumerate(histogram['buckets']):
+                total['buckets'][index] += count
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return values, histograms
+
+
+def clear_directory(directory):
+    # Вызывается мастером gunicorn при запуске: файлы прошлого запуска
+    # (их PID могли достаться новым воркерам) в сумму не попадают.
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    for item in [*path.glob('*.json'), *path.glob('.*.tmp')]:
+        item.unlink(missing_ok=True)
+
+
+def archive_process(directory, pid):
+    # Вызывается мастером gunicorn после завершения воркера: его итоги
+    # добавляются в archive.json, а файл удаляется.
+    path = Path(directory)
+    files = list(path.glob(f'{pid}-*.json'))
+    if not files:
+        return
+    archive = path / ARCHIVE_NAME
+    snapshots = [
+        snapshot for snapshot in map(read_json, [archive, *files])
+        if snapshot is not None
+    ]
+    values, histograms = merge(snapshots)
+    write_json(archive, {
+        'values': [
+            [name, list(labels), value]
+            for (name, labels), value in values.items()
+        ],
+        'histograms': [
+            [name, list(labels), histogram]
+            for (name, labels), histogram in histograms.items()
+        ],
+    })
+    for item in files:
+        item.unlink(missing_ok=True)
+
+
+def inc(name, labels, value=1):
+    registry.inc(name, labels, value)
+
+
+def observe(name, labels, value):
+    registry.observe(name, labels, value)
+
+
+def snapshots():
+    directory = settings.METRICS_DIR
+    if not directory:
+        return [registry.snapshot()]
+    registry.flush(force=True)
+    return [
+        snapshot for snapshot in map(read_json, Path(directory).glob('*.json'))
+        if snapshot is not None
+    ]
+
+
+def collect():
+    return merge(snapshots())
+
+
+def format_labels(names, values, **extra):
+    pairs = [*zip(names, values), *extra.items()]
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n')
+        )
+        for name, value in pairs
+    ) + '}'
+
+
+def render():
+    # Текстовый формат Prometheus 0.0.4.
+    values, histograms = collect()
+    lines = []
+    for name, (kind, description, label_names, buckets) in METRICS.items():
+        full_name = PREFIX + name
+        lines.append(f'# HELP {full_name} {description}')
+        lines.append(f'# TYPE {full_name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(
+                        f'{full_name}{format_labels(label_names, labels)} '
+                        f'{value:g}'
+                    )
+            continue
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, histogram['buckets']):
+                cumulative += count
+                lines.append(
+                    f'{full_name}_bucket'
+                    f'{format_labels(label_names, labels, le=f"{bound:g}")} '
+                    f'{cumulative}'
+                )
+            lines.append(
+                f'{full_name}_bucket'
+                f'{format_labels(label_names, labels, le="+Inf")} '
+                f'{histogram["count"]}'
+            )
+            lines.append(
+                f'{full_name}_sum{format_labels(label_names, labels)} '
+                f'{histogram["sum"]:g}'
+            )
+            lines.append(
+                f'{full_name}_count{format_labels(label_names, labels)} '
+                f'{histogram["count"]}'
+            )
+    return '\n'.join(lines) + '\n'
+
+
+def route_name(request):
+    # Имена маршрутов DRF-роутеров и path(): recipes:recipes-list,
+    # users:user-subscribe, users:subscriptions и т. д.
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    # Стоит перед RequestTimingMiddleware и берёт у неё число запросов к БД.
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        route = route_name(request)
+        status = str(response.status_code)
+        inc('http_requests_total', (route, request.method, status))
+        if response.status_code >= 500:
+            inc('http_errors_total', (route, request.method, status))
+        observe(
+            'http_request_duration_seconds', (route, request.method), elapsed
+        )
+        timings = getattr(request, 'timings', None)
+        if timings is not None:
+            observe(
+                'http_request_db_queries', (route, request.method),
+                timings.queries
+            )
+        registry.flush()
+        return response
+
+    def process_exception(self, request, exception):
+        inc(
+            'http_exceptions_total',
+            (route_name(request), type(exception).__name__)
+        )
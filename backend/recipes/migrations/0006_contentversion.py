@@ -0,0 +1,34 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:07
+
+from django.db import migrations, models
+
+CONTENT_NAMES = (
+    'tags', 'ingredients', 'recipes', 'favorites', 'cart', 'follows', 'users',
+)
+
+
+def create_versions(apps, schema_editor):
+    ContentVersion = apps.get_model('recipes', 'ContentVersion')
+    ContentVersion.objects.bulk_create(
+        (ContentVersion(name=name, version=1) for name in CONTENT_NAMES),
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentVersion',
+            fields=[
+                ('name', models.CharField(max_length=150, primary_key=True, serialize=False)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
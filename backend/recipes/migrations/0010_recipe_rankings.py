@@ -0,0 +1,79 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_version(apps, schema_editor):
+    ContentVersion = apps.get_model('recipes', 'ContentVersion')
+    ContentVersion.objects.get_or_create(
+        name='rankings', defaults={'version': 1}
+    )
+
+
+def fill_added_at(apps, schema_editor):
+    # Настоящее время добавления старых строк неизвестно. Время публикации
+    # рецепта — нижняя граница, с ним давняя активность не попадает в окно
+    # «в тренде» как только что случившаяся.
+    Recipe = apps.get_model('recipes', 'Recipe')
+    pub_date = models.Subquery(
+        Recipe.objects.filter(pk=models.OuterRef('recipe_id'))
+        .values('pub_date')[:1]
+    )
+    for name in ('Favorite', 'ShoppingCart'):
+        apps.get_model('recipes', name).objects.update(added_at=pub_date)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeRank',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feed', models.CharField(choices=[('popular', 'Популярное за неделю'), ('trending', 'В тренде')], max_length=16, verbose_name='Подборка')),
+                ('position', models.PositiveIntegerField(verbose_name='Место')),
+                ('score', models.FloatField(verbose_name='Рейтинг')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Время добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Время добавления'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_added_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['added_at'], name='favorite_added_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['added_at'], name='cart_added_at_idx'),
+        ),
+        migrations.AddField(
+            model_name='reciperank',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranks', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AddConstraint(
+            model_name='reciperank',
+            constraint=models.UniqueConstraint(fields=('feed', 'position'), name='unique_rank_position'),
+        ),
+        migrations.AddConstraint(
+            model_name='reciperank',
+            constraint=models.UniqueConstraint(fields=('feed', 'recipe'), name='unique_rank_recipe'),
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
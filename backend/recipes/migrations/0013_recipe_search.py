@@ -0,0 +1,137 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Индекс строится самой базой по таблице документов: в PostgreSQL это
+# вычисляемый столбец tsvector с GIN-индексом, в SQLite — FTS5-таблица с
+# внешним содержимым, которую обновляют триггеры. Словарь и веса колонок
+# должны совпадать с recipes/search.py.
+INSTALL_SQL = {
+    'postgresql': (
+        """
+        ALTER TABLE recipes_recipesearchdocument ADD COLUMN vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', name), 'A')
+            || setweight(to_tsvector('russian', ingredients), 'B')
+            || setweight(to_tsvector('russian', tags), 'B')
+            || setweight(to_tsvector('russian', text), 'C')
+        ) STORED
+        """,
+        """
+        CREATE INDEX recipe_search_vector_idx
+        ON recipes_recipesearchdocument USING gin (vector)
+        """,
+    ),
+    'sqlite': (
+        """
+        CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5(
+            name, text, ingredients, tags,
+            content='recipes_recipesearchdocument',
+            content_rowid='recipe_id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER recipes_recipe_fts_insert
+        AFTER INSERT ON recipes_recipesearchdocument BEGIN
+            INSERT INTO recipes_recipe_fts(
+                rowid, name, text, ingredients, tags
+            ) VALUES (
+                new.recipe_id, new.name, new.text, new.ingredients, new.tags
+            );
+        END
+        """,
+        """
+        CREATE TRIGGER recipes_recipe_fts_delete
+        AFTER DELETE ON recipes_recipesearchdocument BEGIN
+            INSERT INTO recipes_recipe_fts(
+                recipes_recipe_fts, rowid, name, text, ingredients, tags
+            ) VALUES (
+                'delete', old.recipe_id, old.name, old.text,
+                old.ingredients, old.tags
+            );
+        END
+        """,
+        """
+        CREATE TRIGGER recipes_recipe_fts_update
+        AFTER UPDATE ON recipes_recipesearchdocument BEGIN
+            INSERT INTO recipes_recipe_fts(
+                recipes_recipe_fts, rowid, name, text, ingredients, tags
+            ) VALUES (
+                'delete', old.recipe_id, old.name, old.text,
+                old.ingredients, old.tags
+            );
+            INSERT INTO recipes_recipe_fts(
+                rowid, name, text, ingredients, tags
+            ) VALUES (
+                new.recipe_id, new.name, new.text, new.ingredients, new.tags
+            );
+        END
+        """,
+    ),
+}
+
+UNINSTALL_SQL = {
+    'postgresql': (
+        'DROP INDEX IF EXISTS recipe_search_vector_idx',
+        'ALTER TABLE recipes_recipesearchdocument DROP COLUMN vector',
+    ),
+    'sqlite': (
+        'DROP TRIGGER IF EXISTS recipes_recipe_fts_insert',
+        'DROP TRIGGER IF EXISTS recipes_recipe_fts_delete',
+        'DROP TRIGGER IF EXISTS recipes_recipe_fts_update',
+        'DROP TABLE IF EXISTS recipes_recipe_fts',
+    ),
+}
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(statement)
+    return operation
+
+
+def fill_documents(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeSearchDocument = apps.get_model('recipes', 'RecipeSearchDocument')
+    RecipeSearchDocument.objects.bulk_create(
+        (
+            RecipeSearchDocument(
+                recipe=recipe,
+                name=recipe.name,
+                text=recipe.text,
+                ingredients=' '.join(
+                    ingredient.name for ingredient in recipe.ingredients.all()
+                ),
+                tags=' '.join(tag.name for tag in recipe.tags.all())
+            )
+            for recipe in Recipe.objects.prefetch_related(
+                'ingredients', 'tags'
+            ).iterator(chunk_size=500)
+        ),
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSearchDocument',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('name', models.CharField(max_length=150, verbose_name='Название')),
+                ('text', models.TextField(verbose_name='Описание')),
+                ('ingredients', models.TextField(verbose_name='Ингредиенты')),
+                ('tags', models.TextField(verbose_name='Теги')),
+            ],
+        ),
+        migrations.RunPython(run(INSTALL_SQL), run(UNINSTALL_SQL)),
+        migrations.RunPython(fill_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:35
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_ingredients_count(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    Recipe.objects.update(
+        ingredients_count=Coalesce(
+            models.Subquery(
+                IngredientRecipe.objects.filter(recipe=models.OuterRef('pk'))
+                .order_by()
+                .values('recipe')
+                .annotate(total=models.Count('pk'))
+                .values('total')
+            ),
+            0
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число ингредиентов'),
+        ),
+        migrations.RunPython(
+            fill_ingredients_count, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_ingredients_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSignature',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='signature', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('signature', models.BinaryField(verbose_name='Подпись')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecipeBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField(verbose_name='Полоса')),
+                ('bucket', models.BigIntegerField(verbose_name='Корзина')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['band', 'bucket'], name='recipe_bucket_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recipebucket',
+            constraint=models.UniqueConstraint(fields=('recipe', 'band'), name='unique_recipe_band'),
+        ),
+    ]
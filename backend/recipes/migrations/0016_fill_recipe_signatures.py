@@ -0,0 +1,94 @@
+import hashlib
+import random
+import struct
+from itertools import groupby
+
+from django.db import migrations
+from django.db.models import F
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+
+# Копия MinHash и LSH из recipes/similarity.py на момент миграции: от
+# живого модуля она не зависит, и его последующие правки не меняют то,
+# что записывает эта миграция.
+BANDS = 16
+ROWS = 4
+PERMUTATIONS = BANDS * ROWS
+PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+SIGNATURE_FORMAT = f'<{PERMUTATIONS}I'
+_random = random.Random(20231018)
+COEFFICIENTS = [
+    (_random.randrange(1, PRIME), _random.randrange(0, PRIME))
+    for _ in range(PERMUTATIONS)
+]
+
+
+def signature(ingredient_ids):
+    return tuple(
+        min((a * value + b) % PRIME for value in ingredient_ids) & MAX_HASH
+        for a, b in COEFFICIENTS
+    )
+
+
+def pack(values):
+    return struct.pack(SIGNATURE_FORMAT, *values)
+
+
+def buckets(values):
+    data = pack(values)
+    size = ROWS * struct.calcsize('<I')
+    for band in range(BANDS):
+        rows = data[band * size:(band + 1) * size]
+        digest = hashlib.blake2b(rows, digest_size=8).digest()
+        yield band, int.from_bytes(digest, 'big', signed=True)
+
+
+def fill_signatures(apps, schema_editor):
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    RecipeSignature = apps.get_model('recipes', 'RecipeSignature')
+    RecipeBucket = apps.get_model('recipes', 'RecipeBucket')
+    ContentVersion = apps.get_model('recipes', 'ContentVersion')
+
+    def save(signatures, bucket_rows):
+        RecipeSignature.objects.bulk_create(signatures, batch_size=500)
+        RecipeBucket.objects.bulk_create(bucket_rows, batch_size=1000)
+
+    signatures, bucket_rows = [], []
+    rows = IngredientRecipe.objects.order_by('recipe_id').values_list(
+        'recipe_id', 'ingredient_id'
+    ).iterator()
+    for recipe_id, group in groupby(rows, key=lambda row: row[0]):
+        values = signature([row[1] for row in group])
+        signatures.append(RecipeSignature(
+            recipe_id=recipe_id, signature=pack(values)
+        ))
+        bucket_rows.extend(
+            RecipeBucket(recipe_id=recipe_id, band=band, bucket=bucket)
+            for band, bucket in buckets(values)
+        )
+        if len(signatures) >= BATCH_SIZE:
+            save(signatures, bucket_rows)
+            signatures, bucket_rows = [], []
+    save(signatures, bucket_rows)
+
+    ContentVersion.objects.filter(name='recipes').update(
+        version=F('version') + 1, updated_at=timezone.now()
+    )
+
+
+def clear_signatures(apps, schema_editor):
+    apps.get_model('recipes', 'RecipeBucket').objects.all().delete()
+    apps.get_model('recipes', 'RecipeSignature').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_recipe_similarity'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_signatures, clear_signatures),
+    ]
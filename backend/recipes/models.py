@@ -1,11 +1,16 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.validators import (
     MinValueValidator,
     RegexValidator,
     MaxValueValidator
 )
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.functions import Cast, Coalesce, Greatest
+from django.utils import timezone
 
+from users.models import Follow
 
 User = get_user_model()
 
@@ -15,6 +20,7 @@ MAX_FIELD_LENGTH = 150
 MIN_INGREDIENT_AMOUNT = 1
 MAX_INGREDIENT_AMOUNT = 5000
 MAX_HEX_FIELD_LENGTH = 7
+SHOPPING_LIST_BATCH_SIZE = 300
 
 
 class Ingredient(models.Model):
@@ -63,6 +69,110 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    @staticmethod
+    def related_lookups():
+        return (
+            'tags',
+            models.Prefetch(
+                'ingredient_recipe',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            ),
+            'author',
+        )
+
+    def with_related(self):
+        return self.prefetch_related(*self.related_lookups())
+
+    def with_user_flags(self, user):
+        if user.is_authenticated:
+            is_favorited = models.Exists(
+                Favorite.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )
+            )
+            is_in_shopping_cart = models.Exists(
+                ShoppingCart.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )
+            )
+            author_is_subscribed = models.Exists(
+                Follow.objects.filter(
+                    user=user, author=models.OuterRef('author_id')
+                )
+            )
+        else:
+            is_favorited = is_in_shopping_cart = author_is_subscribed = (
+                models.Value(False)
+            )
+
+        return self.annotate(
+            is_favorited=is_favorited,
+            is_in_shopping_cart=is_in_shopping_cart,
+            author_is_subscribed=author_is_subscribed,
+        )
+
+    @staticmethod
+    def actual_count(model):
+        return Coalesce(
+            models.Subquery(
+                model.objects.filter(recipe=models.OuterRef('pk'))
+                .order_by()
+                .values('recipe')
+                .annotate(total=models.Count('pk'))
+                .values('total')
+            ),
+            0
+        )
+
+    def ranked(self, feed):
+        return self.annotate(
+            feed_rank=models.FilteredRelation(
+                'ranks', condition=models.Q(ranks__feed=feed)
+            ),
+        ).filter(feed_rank__isnull=False).annotate(
+            rank=models.F('feed_rank__position')
+        ).order_by('rank')
+
+    def with_actual_counters(self):
+        return self.annotate(
+            actual_favorites_count=self.actual_count(Favorite),
+            actual_in_carts_count=self.actual_count(ShoppingCart),
+            actual_ingredients_count=self.actual_count(IngredientRecipe),
+        )
+
+    def recount(self):
+        return self.update(
+            favorites_count=self.actual_count(Favorite),
+            in_carts_count=self.actual_count(ShoppingCart),
+            ingredients_count=self.actual_count(IngredientRecipe),
+        )
+
+    def cookable(self, ingredient_ids):
+        # Кандидаты берутся из индекса (ingredient, recipe) по переданным
+        # ингредиентам, так что затраты растут с числом этих строк, а не с
+        # размером таблицы; общее число ингредиентов хранится в рецепте.
+        postings = IngredientRecipe.objects.filter(
+            ingredient_id__in=ingredient_ids
+        )
+        available = models.Subquery(
+            postings.filter(recipe=models.OuterRef('pk'))
+            .order_by()
+            .values('recipe')
+            .annotate(total=models.Count('pk'))
+            .values('total')
+        )
+        # Greatest страхует от устаревшего счётчика (деление на ноль).
+        total = Greatest('ingredients_count', 'available')
+        return self.filter(
+            id__in=postings.values('recipe_id')
+        ).annotate(
+            available=available,
+            missing=total - models.F('available'),
+            coverage=Cast('available', models.FloatField()) / total,
+        ).order_by('-coverage', 'missing', '-id')
+
+
 class Recipe(models.Model):
     name = models.CharField(
         max_length=MAX_FIELD_LENGTH,
@@ -104,9 +214,40 @@ class Recipe(models.Model):
             ),
         ),
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Добавления в избранное', default=0, editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='Добавления в список покупок', default=0, editable=False
+    )
+    ingredients_count = models.PositiveIntegerField(
+        verbose_name='Число ингредиентов', default=0, editable=False
+    )
+    version = models.PositiveIntegerField(
+        verbose_name='Версия', default=1, editable=False
+    )
+    image_renditions = models.JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        default=dict,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('pub_date',)
+        indexes = (
+            models.Index(
+                fields=('-favorites_count', '-id'),
+                name='recipe_favorites_count_idx'
+            ),
+            models.Index(
+                fields=('-pub_date', '-id'), name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date'), name='recipe_author_date_idx'
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -149,6 +290,132 @@ class IngredientRecipe(models.Model):
         ]
 
 
+def relations_cache_key(kind, user_id):
+    return f'relations:{kind}:{user_id}'
+
+
+def user_content(kind, user_id):
+    # Имя версии связей одного пользователя (избранное, корзина, подписки)
+    # для валидаторов ConditionalGetMixin.per_user_content.
+    return f'{kind}:{user_id}'
+
+
+def relations_changed(kind, user_id):
+    # Снимок связей пользователя (recipes.relations) сбрасывается после
+    # коммита, чтобы параллельный запрос не закэшировал старое состояние.
+    # Версия для валидаторов тоже поднимается после коммита: строка
+    # ContentVersion не остаётся заблокированной до конца транзакции.
+    def changed():
+        if settings.RELATIONS_CACHE_TIMEOUT:
+            cache.delete(relations_cache_key(kind, user_id))
+        ContentVersion.objects.bump(user_content(kind, user_id))
+
+    transaction.on_commit(changed)
+
+
+class UserRecipeQuerySet(models.QuerySet):
+    # Избранное и корзина меняются через эти методы: версия связей
+    # пользователя поднимается один раз на операцию и после коммита,
+    # счётчик рецепта (counter_field) сдвигается одним запросом для всех
+    # затронутых рецептов.
+    def add(self, user, recipe_ids):
+        # Рецепты, которые успел добавить параллельный запрос, пропускает
+        # ON CONFLICT DO NOTHING. Добавленные этим вызовом строки находятся
+        # повторным SELECT по времени добавления.
+        recipe_ids = list(recipe_ids)
+        started = timezone.now()
+        self.bulk_create(
+            (self.model(user=user, recipe_id=pk) for pk in recipe_ids),
+            ignore_conflicts=True,
+        )
+        added = list(
+            self.filter(
+                user=user, recipe_id__in=recipe_ids, added_at__gte=started
+            ).values_list('recipe_id', flat=True)
+        )
+        if added:
+            self.changed(user, added, 1)
+        return added
+
+    def add_one(self, user, recipe_id):
+        # Одна вставка без предварительного SELECT: несуществующий рецепт
+        # отсекает INSERT ... SELECT, повторное добавление — ON CONFLICT.
+        # Счётчик сдвигается UPDATE ... RETURNING, который заодно отдаёт
+        # поля рецепта для ответа. None — ничего не добавлено.
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        recipe_table = quote(Recipe._meta.db_table)
+        recipe_id = Recipe._meta.pk.get_prep_value(recipe_id)
+        added_at = self.model._meta.get_field('added_at').get_db_prep_value(
+            timezone.now(), connection
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(self.model._meta.db_table)} '
+                f'({quote("user_id")}, {quote("recipe_id")}, '
+                f'{quote("added_at")}) '
+                f'SELECT %s, {quote("id")}, %s FROM {recipe_table} '
+                f'WHERE {quote("id")} = %s '
+                f'ON CONFLICT ({quote("user_id")}, {quote("recipe_id")}) '
+                f'DO NOTHING RETURNING {quote("recipe_id")}',
+                [user.pk, added_at, recipe_id]
+            )
+            if cursor.fetchone() is None:
+                return None
+        field = quote(self.model.counter_field)
+        recipe = next(iter(Recipe.objects.using(self.db).raw(
+            f'UPDATE {recipe_table} SET {field} = {field} + 1 '
+            f'WHERE {quote("id")} = %s RETURNING {quote("id")}, '
+            f'{quote("name")}, {quote("image")}, '
+            f'{quote("image_renditions")}, {quote("cooking_time")}',
+            [recipe_id]
+        )))
+        relations_changed(self.model.content_version, user.pk)
+        return recipe
+
+    def remove(self, user, recipe_ids):
+        with transaction.atomic(savepoint=False):
+            removed = dict(
+                self.select_for_update()
+                .filter(user=user, recipe_id__in=recipe_ids)
+                .values_list('pk', 'recipe_id')
+            )
+            if removed:
+                self.filter(pk__in=removed).delete()
+                self.changed(user, removed.values(), -1)
+        return list(removed.values())
+
+    def remove_one(self, user, recipe_id):
+        # delete() оборачивает удаление в транзакцию коллектора, а у этих
+        # строк нет ни сигналов, ни каскадов: хватает одного DELETE.
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        recipe_id = Recipe._meta.pk.get_prep_value(recipe_id)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote(self.model._meta.db_table)} '
+                f'WHERE {quote("user_id")} = %s '
+                f'AND {quote("recipe_id")} = %s',
+                [user.pk, recipe_id]
+            )
+            deleted = cursor.rowcount
+        if deleted:
+            self.changed(user, [recipe_id], -1)
+        return bool(deleted)
+
+    def release_user(self, user):
+        # Строки пользователя удаляются каскадом без сигналов, поэтому
+        # счётчики рецептов уменьшаются заранее, в pre_delete пользователя.
+        self.changed(user, self.filter(user=user).values('recipe_id'), -1)
+
+    def changed(self, user, recipe_ids, delta):
+        field = self.model.counter_field
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            **{field: Greatest(models.F(field) + delta, 0)}
+        )
+        relations_changed(self.model.content_version, user.pk)
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         User,
@@ -162,6 +429,13 @@ class Favorite(models.Model):
         related_name='favorites',
         verbose_name='Рецепт'
     )
+    added_at = models.DateTimeField(
+        verbose_name='Время добавления', auto_now_add=True
+    )
+
+    content_version = 'favorites'
+    counter_field = 'favorites_count'
+    objects = UserRecipeQuerySet.as_manager()
 
     class Meta:
         constraints = (
@@ -169,6 +443,12 @@ class Favorite(models.Model):
                 fields=['user', 'recipe'], name='unique_favorite_recipe'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('recipe', 'user'), name='favorite_recipe_user_idx'
+            ),
+            models.Index(fields=('added_at',), name='favorite_added_at_idx'),
+        )
 
     def __str__(self):
         return f'{self.user} -> {self.recipe}'
@@ -187,6 +467,13 @@ class ShoppingCart(models.Model):
         related_name='cart',
         verbose_name='Рецепт'
     )
+    added_at = models.DateTimeField(
+        verbose_name='Время добавления', auto_now_add=True
+    )
+
+    content_version = 'cart'
+    counter_field = 'in_carts_count'
+    objects = UserRecipeQuerySet.as_manager()
 
     class Meta:
         constraints = (
@@ -194,3 +481,301 @@ class ShoppingCart(models.Model):
                 fields=['user', 'recipe'], name='unique_cart'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('recipe', 'user'), name='cart_recipe_user_idx'
+            ),
+            models.Index(fields=('added_at',), name='cart_added_at_idx'),
+        )
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    def apply_recipe(self, recipe, user_ids, sign=1):
+        self.apply_recipes([recipe], user_ids, sign)
+
+    def apply_recipes(self, recipes, user_ids, sign=1):
+        user_ids = list(user_ids)
+        amounts = dict(
+            IngredientRecipe.objects.filter(recipe__in=recipes)
+            .values('ingredient_id')
+            .annotate(sum_amount=models.Sum('amount'))
+            .values_list('ingredient_id', 'sum_amount')
+            .order_by()
+        )
+        if not user_ids or not amounts:
+            return
+        if sign > 0:
+            self.add_amounts(user_ids, amounts)
+            return
+
+        items = self.filter(user_id__in=user_ids, ingredient_id__in=amounts)
+        with transaction.atomic(savepoint=False):
+            items.update(amount=Greatest(
+                models.F('amount') - models.Case(
+                    *(
+                        models.When(ingredient_id=ingredient_id, then=amount)
+                        for ingredient_id, amount in amounts.items()
+                    ),
+                    output_field=models.PositiveIntegerField(),
+                ),
+                0
+            ))
+            items.filter(amount=0).delete()
+
+    def add_amounts(self, user_ids, amounts):
+        # INSERT ... ON CONFLICT DO UPDATE прибавляет к строке, которую
+        # успел создать параллельный запрос, вместо ошибки уникальности.
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        amount = quote('amount')
+        rows = [
+            (user_id, ingredient_id, value)
+            for user_id in user_ids
+            for ingredient_id, value in amounts.items()
+        ]
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), SHOPPING_LIST_BATCH_SIZE):
+                batch = rows[start:start + SHOPPING_LIST_BATCH_SIZE]
+                cursor.execute(
+                    f'INSERT INTO {table} ({quote("user_id")}, '
+                    f'{quote("ingredient_id")}, {amount}) VALUES '
+                    + ', '.join(['(%s, %s, %s)'] * len(batch))
+                    + f' ON CONFLICT ({quote("user_id")}, '
+                    f'{quote("ingredient_id")}) DO UPDATE SET '
+                    f'{amount} = {table}.{amount} + EXCLUDED.{amount}',
+                    [value for row in batch for value in row]
+                )
+
+    def rebuild(self, user_ids=None):
+        carts = ShoppingCart.objects.all()
+        items = self.all()
+        if user_ids is not None:
+            carts = carts.filter(user_id__in=user_ids)
+            items = items.filter(user_id__in=user_ids)
+
+        aggregate = (
+            carts.values(
+                'user_id', 'recipe__ingredient_recipe__ingredient_id'
+            )
+            .exclude(recipe__ingredient_recipe=None)
+            .annotate(
+                sum_amount=models.Sum('recipe__ingredient_recipe__amount')
+            )
+            .order_by()
+        )
+        with transaction.atomic():
+            items.delete()
+            return len(self.bulk_create(
+                (
+                    self.model(
+                        user_id=row['user_id'],
+                        ingredient_id=row[
+                            'recipe__ingredient_recipe__ingredient_id'
+                        ],
+                        amount=row['sum_amount'],
+                    )
+                    for row in aggregate.iterator()
+                ),
+                batch_size=1000,
+            ))
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'], name='unique_shopping_list_item'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user} -> {self.ingredient}: {self.amount}'
+
+
+class RecipeRank(models.Model):
+    POPULAR = 'popular'
+    TRENDING = 'trending'
+    FEEDS = (
+        (POPULAR, 'Популярное за неделю'),
+        (TRENDING, 'В тренде'),
+    )
+
+    feed = models.CharField(
+        max_length=16, choices=FEEDS, verbose_name='Подборка'
+    )
+    position = models.PositiveIntegerField(verbose_name='Место')
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='ranks',
+        verbose_name='Рецепт'
+    )
+    score = models.FloatField(verbose_name='Рейтинг')
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=['feed', 'position'], name='unique_rank_position'
+            ),
+            models.UniqueConstraint(
+                fields=['feed', 'recipe'], name='unique_rank_recipe'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.feed} #{self.position}: {self.recipe_id}'
+
+
+class RecipeSignature(models.Model):
+    # MinHash-подпись набора ингредиентов, см. recipes/similarity.py.
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='signature',
+        verbose_name='Рецепт'
+    )
+    signature = models.BinaryField(verbose_name='Подпись')
+
+    def __str__(self):
+        return f'{self.recipe_id}'
+
+
+class RecipeBucket(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='buckets',
+        verbose_name='Рецепт'
+    )
+    band = models.PositiveSmallIntegerField(verbose_name='Полоса')
+    bucket = models.BigIntegerField(verbose_name='Корзина')
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=['recipe', 'band'], name='unique_recipe_band'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('band', 'bucket'), name='recipe_bucket_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.band}:{self.bucket} -> {self.recipe_id}'
+
+
+class RecipeSearchDocumentQuerySet(models.QuerySet):
+    def rebuild(self, recipe_ids=None):
+        # Поисковый индекс (tsvector в PostgreSQL, FTS5 в SQLite) база
+        # поддерживает сама по этой таблице, см. миграцию 0013.
+        recipes = Recipe.objects.prefetch_related('ingredients', 'tags')
+        documents = self.all()
+        if recipe_ids is not None:
+            recipes = recipes.filter(id__in=recipe_ids)
+            documents = documents.filter(recipe_id__in=recipe_ids)
+
+        with transaction.atomic():
+            documents.delete()
+            created = self.model.objects.bulk_create(
+                (
+                    self.model(
+                        recipe=recipe,
+                        name=recipe.name,
+                        text=recipe.text,
+                        ingredients=' '.join(
+                            ingredient.name
+                            for ingredient in recipe.ingredients.all()
+                        ),
+                        tags=' '.join(tag.name for tag in recipe.tags.all())
+                    )
+                    for recipe in recipes.iterator(chunk_size=500)
+                ),
+                batch_size=500
+            )
+        return len(created)
+
+
+class RecipeSearchDocument(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_document',
+        verbose_name='Рецепт'
+    )
+    name = models.CharField(
+        max_length=MAX_FIELD_LENGTH, verbose_name='Название'
+    )
+    text = models.TextField(verbose_name='Описание')
+    ingredients = models.TextField(verbose_name='Ингредиенты')
+    tags = models.TextField(verbose_name='Теги')
+
+    objects = RecipeSearchDocumentQuerySet.as_manager()
+
+    def __str__(self):
+        return self.name
+
+
+class ContentVersionQuerySet(models.QuerySet):
+    def bump(self, *names):
+        # Одним запросом и без предварительного SELECT: версии на
+        # пользователя (user_content) создаются при первом изменении.
+        # ON CONFLICT DO UPDATE есть и в PostgreSQL, и в SQLite.
+        names = list(dict.fromkeys(names))
+        if not names:
+            return
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        version = quote('version')
+        updated_at = quote('updated_at')
+        now = self.model._meta.get_field('updated_at').get_db_prep_value(
+            timezone.now(), connection
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({quote("name")}, {version}, '
+                f'{updated_at}) VALUES '
+                + ', '.join(['(%s, 1, %s)'] * len(names))
+                + f' ON CONFLICT ({quote("name")}) DO UPDATE SET '
+                f'{version} = {table}.{version} + 1, '
+                f'{updated_at} = EXCLUDED.{updated_at}',
+                [value for name in names for value in (name, now)]
+            )
+
+    def current(self, names):
+        return {
+            item.name: item
+            for item in self.filter(name__in=names)
+        }
+
+
+class ContentVersion(models.Model):
+    name = models.CharField(max_length=MAX_FIELD_LENGTH, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ContentVersionQuerySet.as_manager()
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
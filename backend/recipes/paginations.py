@@ -1,5 +1,124 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPageNumberPagination(pagination.PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class KeysetPagination(CustomPageNumberPagination):
+    # Включается параметром ?cursor= (пустым для первой страницы), без него
+    # работает как CustomPageNumberPagination. Последнее поле порядка
+    # keyset_ordering должно быть уникальным.
+    cursor_query_param = 'cursor'
+    keyset_ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Некорректный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.keyset_ordering = getattr(
+            view, 'keyset_ordering', self.keyset_ordering
+        )
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset)
+
+        ordering = self.keyset_ordering
+        if reverse:
+            ordering = tuple(
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            )
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else position is not None
+        self.first = results[0] if results else None
+        self.last = results[-1] if results else None
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_cursor_link(self.last, False)
+            if self.has_next else None,
+            'previous': self.get_cursor_link(self.first, True)
+            if self.has_previous else None,
+            'results': data,
+        })
+
+    @staticmethod
+    def after(ordering, position):
+        condition = Q()
+        for index, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {
+                name.lstrip('-'): value
+                for name, value in zip(ordering[:index], position[:index])
+            }
+            condition |= Q(
+                **equal, **{f'{field.lstrip("-")}__{lookup}': position[index]}
+            )
+        return condition
+
+    def get_cursor_link(self, obj, reverse):
+        if obj is None:
+            return None
+        position = []
+        for field in self.keyset_ordering:
+            value = getattr(obj, field.lstrip('-'))
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            position.append(value)
+        cursor = base64.urlsafe_b64encode(
+            json.dumps({'p': position, 'r': reverse}).encode()
+        ).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, cursor
+        )
+
+    @staticmethod
+    def get_field(queryset, name):
+        # Порядок может идти и по аннотации (место в подборке).
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    def decode_cursor(self, request, queryset):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            position = [
+                self.get_field(queryset, field.lstrip('-')).to_python(value)
+                for field, value in zip(self.keyset_ordering, data['p'])
+            ]
+            if len(position) != len(self.keyset_ordering):
+                raise ValueError
+            return position, bool(data['r'])
+        except (
+            binascii.Error, ValueError, KeyError, TypeError, ValidationError
+        ):
+            raise NotFound(self.invalid_cursor_message)
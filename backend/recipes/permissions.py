@@ -1,3 +1,6 @@
+import ipaddress
+
+from django.conf import settings
 from rest_framework import permissions
 
 
@@ -13,3 +16,33 @@ class IsAuthenticatedOwnerOrReadOnly(permissions.IsAuthenticated):
             request.method in permissions.SAFE_METHODS
             or obj.author == request.user
         )
+
+
+class IsStaffOrInternal(permissions.BasePermission):
+    # Адрес клиента — REMOTE_ADDR. X-Real-IP учитывается, только если
+    # запрос пришёл от прокси из METRICS_TRUSTED_PROXIES: иначе его может
+    # подставить сам клиент.
+    def has_permission(self, request, view):
+        if request.user is not None and request.user.is_staff:
+            return True
+        address = parse_address(request.META.get('REMOTE_ADDR', ''))
+        if address is not None and in_networks(
+            address, settings.METRICS_TRUSTED_PROXIES
+        ):
+            address = parse_address(request.META.get('HTTP_X_REAL_IP', ''))
+        return address is not None and in_networks(
+            address, settings.METRICS_ALLOWED_NETWORKS
+        )
+
+
+def parse_address(value):
+    try:
+        return ipaddress.ip_address(value)
+    except ValueError:
+        return None
+
+
+def in_networks(address, networks):
+    return any(
+        address in ipaddress.ip_network(network) for network in networks
+    )
@@ -0,0 +1,72 @@
+import heapq
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import (
+    ContentVersion,
+    Favorite,
+    Recipe,
+    RecipeRank,
+    ShoppingCart,
+)
+
+# Окно и период полураспада в часах: добавление недельной давности в
+# «популярном» весит вдвое меньше, чем добавление трёхдневной давности,
+# а «в тренде» учитывает только последние двое суток.
+FEEDS = {
+    RecipeRank.POPULAR: (7 * 24, 72),
+    RecipeRank.TRENDING: (48, 12),
+}
+# Рецепт в списке покупок — более сильный сигнал, чем избранное.
+WEIGHTS = ((Favorite, 1.0), (ShoppingCart, 1.5))
+
+
+def compute_scores(feed, now):
+    window, half_life = FEEDS[feed]
+    scores = defaultdict(float)
+    for model, weight in WEIGHTS:
+        # Добавления группируются по часам прямо в БД, в Python приходит
+        # не больше строк, чем пар «рецепт, час» в окне.
+        rows = (
+            model.objects.filter(added_at__gte=now - timedelta(hours=window))
+            .annotate(hour=TruncHour('added_at'))
+            .values('recipe_id', 'hour')
+            .annotate(events=Count('pk'))
+            .values_list('recipe_id', 'hour', 'events')
+            .order_by()
+        )
+        for recipe_id, hour, events in rows.iterator():
+            age = (now - hour).total_seconds() / 3600
+            scores[recipe_id] += weight * events * 0.5 ** (age / half_life)
+    return scores
+
+
+def refresh(feed, size=None, now=None):
+    size = size or settings.RANKING_SIZE
+    scores = compute_scores(feed, now or timezone.now())
+    top = heapq.nlargest(
+        size, scores.items(), key=lambda item: (item[1], -item[0])
+    )
+    with transaction.atomic():
+        existing = set(
+            Recipe.objects.filter(
+                id__in=[recipe_id for recipe_id, _ in top]
+            ).values_list('id', flat=True)
+        )
+        RecipeRank.objects.filter(feed=feed).delete()
+        ranks = RecipeRank.objects.bulk_create(
+            RecipeRank(
+                feed=feed, position=position, recipe_id=recipe_id, score=score
+            )
+            for position, (recipe_id, score) in enumerate(
+                (item for item in top if item[0] in existing), 1
+            )
+        )
+        ContentVersion.objects.bump('rankings')
+    return len(ranks)
@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from users.models import Follow
+from . import metrics
+from .models import Favorite, ShoppingCart, relations_cache_key
+
+# Набор id для каждого вида связи: модель и поле с id объекта.
+KINDS = {
+    'favorites': (Favorite, 'recipe_id'),
+    'cart': (ShoppingCart, 'recipe_id'),
+    'follows': (Follow, 'author_id'),
+}
+
+
+class Relations:
+    # Снимок связей пользователя на время запроса: каждый набор id
+    # загружается не больше одного раза, дальше флаги — проверка
+    # вхождения в множество.
+    def __init__(self, user):
+        self.user = user
+        self.sets = {}
+
+    def ids(self, kind):
+        if kind not in self.sets:
+            self.sets[kind] = self.load(kind)
+        return self.sets[kind]
+
+    def load(self, kind):
+        if self.user is None or not self.user.is_authenticated:
+            return frozenset()
+        timeout = settings.RELATIONS_CACHE_TIMEOUT
+        key = relations_cache_key(kind, self.user.pk)
+        if timeout:
+            ids = cache.get(key)
+            metrics.inc(
+                'cache_requests_total',
+                ('relations', 'miss' if ids is None else 'hit')
+            )
+            if ids is not None:
+                return ids
+        model, field = KINDS[kind]
+        ids = frozenset(
+            model.objects.filter(user=self.user).values_list(field, flat=True)
+        )
+        if timeout:
+            cache.set(key, ids, timeout)
+        return ids
+
+    def is_favorited(self, recipe_id):
+        return recipe_id in self.ids('favorites')
+
+    def is_in_shopping_cart(self, recipe_id):
+        return recipe_id in self.ids('cart')
+
+    def is_subscribed(self, author_id):
+        return author_id in self.ids('follows')
+
+
+def get_relations(context):
+    # Вложенные сериализаторы делят контекст корневого, а отдельно
+    # созданные в том же запросе находят снимок на самом запросе.
+    if 'relations' not in context:
+        request = context.get('request')
+        if request is None:
+            context['relations'] = Relations(None)
+        else:
+            if not hasattr(request, 'relations_snapshot'):
+                request.relations_snapshot = Relations(request.user)
+            context['relations'] = request.relations_snapshot
+    return context['relations']
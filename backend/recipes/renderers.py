@@ -0,0 +1,214 @@
+import abc
+import csv
+import io
+import json
+import os
+import zlib
+from itertools import islice
+
+from PIL import Image, ImageDraw, ImageFont
+from rest_framework import renderers
+
+FONT_PATH = os.path.join(os.path.dirname(__file__), 'fonts', 'ARIAL.TTF')
+PDF_PAGE_SIZE = (1240, 1754)
+PDF_RESOLUTION = 150
+PDF_MARGIN = 100
+PDF_FONT_SIZE = 28
+PDF_LINE_HEIGHT = 44
+
+
+def shopping_list_rows(ingredients):
+    for index, item in enumerate(ingredients, 1):
+        yield (
+            index,
+            item['ingredient__name'].capitalize(),
+            item['sum_amount'],
+            item['ingredient__measurement_unit'],
+        )
+
+
+class ShoppingListRenderer(renderers.BaseRenderer, metaclass=abc.ABCMeta):
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # Ответы с ошибками (401, 404) отдаются тем же рендерером.
+            return json.dumps(data, ensure_ascii=False).encode()
+        return b''.join(
+            chunk if isinstance(chunk, bytes) else chunk.encode(self.charset)
+            for chunk in self.stream(data)
+        )
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+    @abc.abstractmethod
+    def stream(self, ingredients):
+        """Отдаёт файл по частям (str или bytes) по мере чтения строк."""
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for index, name, amount, unit in shopping_list_rows(ingredients):
+            yield f'{index:02}. {name} - {amount} {unit}\n'
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(('№', 'Ингредиент', 'Количество', 'Единицы'))
+        for row in shopping_list_rows(ingredients):
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, ingredients):
+        yield '['
+        for index, name, amount, unit in shopping_list_rows(ingredients):
+            if index > 1:
+                yield ','
+            yield json.dumps(
+                {'name': name, 'amount': amount, 'measurement_unit': unit},
+                ensure_ascii=False,
+            )
+        yield ']'
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def stream(self, ingredients):
+        # PDF пишется сам, без Pillow.save: каждая страница рисуется,
+        # сжимается и отдаётся сразу, в памяти не больше одной страницы.
+        # Каталог, дерево страниц и таблица смещений идут в конце файла.
+        font = ImageFont.truetype(FONT_PATH, PDF_FONT_SIZE)
+        lines_per_page = (
+            (PDF_PAGE_SIZE[1] - 2 * PDF_MARGIN) // PDF_LINE_HEIGHT
+        )
+        lines = iter(['Список покупок', '', *(
+            f'{index:02}. {name} - {amount} {unit}'
+            for index, name, amount, unit in shopping_list_rows(ingredients)
+        )])
+        width, height = (
+            size * 72 / PDF_RESOLUTION for size in PDF_PAGE_SIZE
+        )
+        writer = PDFWriter()
+        yield writer.header()
+
+        page_ids = []
+        while page_lines := list(islice(lines, lines_per_page)):
+            page = Image.new('L', PDF_PAGE_SIZE, 'white')
+            draw = ImageDraw.Draw(page)
+            for number, line in enumerate(page_lines):
+                draw.text(
+                    (PDF_MARGIN, PDF_MARGIN + number * PDF_LINE_HEIGHT),
+                    line,
+                    font=font,
+                    fill='black',
+                )
+            image_id, content_id, page_id = writer.reserve(3)
+            yield writer.object(image_id, (
+                f'<< /Type /XObject /Subtype /Image '
+                f'/Width {PDF_PAGE_SIZE[0]} /Height {PDF_PAGE_SIZE[1]} '
+                '/ColorSpace /DeviceGray /BitsPerComponent 8 '
+                '/Filter /FlateDecode'
+            ), zlib.compress(page.tobytes()))
+            yield writer.object(
+                content_id, '<<',
+                f'q {width:.2f} 0 0 {height:.2f} 0 0 cm /Page Do Q'.encode()
+            )
+            yield writer.object(page_id, (
+                f'<< /Type /Page /Parent {PDFWriter.PAGES} 0 R '
+                f'/MediaBox [0 0 {width:.2f} {height:.2f}] '
+                f'/Resources << /XObject << /Page {image_id} 0 R >> >> '
+                f'/Contents {content_id} 0 R >>'
+            ))
+            page_ids.append(page_id)
+
+        kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+        yield writer.object(PDFWriter.PAGES, (
+            f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'
+        ))
+        yield writer.object(
+            PDFWriter.CATALOG,
+            f'<< /Type /Catalog /Pages {PDFWriter.PAGES} 0 R >>'
+        )
+        yield writer.trailer()
+
+
+class PDFWriter:
+    # Минимальный писатель PDF 1.4: объекты выдаются по одному, смещения
+    # запоминаются для таблицы xref.
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.last_id = self.PAGES
+
+    def write(self, data):
+        self.offset += len(data)
+        return data
+
+    def header(self):
+        return self.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def reserve(self, count):
+        ids = range(self.last_id + 1, self.last_id + count + 1)
+        self.last_id += count
+        return ids
+
+    def object(self, object_id, dictionary, stream=None):
+        self.offsets[object_id] = self.offset
+        if stream is None:
+            body = f'{dictionary}\n'.encode()
+        else:
+            # Словарь потока дописывается длиной и закрывается здесь.
+            body = (
+                f'{dictionary} /Length {len(stream)} >>\nstream\n'.encode()
+                + stream + b'\nendstream\n'
+            )
+        return self.write(
+            f'{object_id} 0 obj\n'.encode() + body + b'endobj\n'
+        )
+
+    def trailer(self):
+        size = self.last_id + 1
+        xref = [f'xref\n0 {size}\n', '0000000000 65535 f \n']
+        xref.extend(
+            f'{self.offsets[object_id]:010} 00000 n \n'
+            for object_id in range(1, size)
+        )
+        xref.append(
+            f'trailer\n<< /Size {size} /Root {self.CATALOG} 0 R >>\n'
+            f'startxref\n{self.offset}\n%%EOF\n'
+        )
+        return self.write(''.join(xref).encode())
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    JSONShoppingListRenderer,
+    PDFShoppingListRenderer,
+)
@@ -0,0 +1,151 @@
+import html
+import re
+import threading
+
+from django.db import connection, transaction
+from django.db.models import FloatField, TextField
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe, RecipeSearchDocument
+
+MAX_TERMS = 8
+# Совпадения помечаются символами из области частного использования и
+# превращаются в <mark> уже после экранирования текста рецепта.
+MARK_START = '\ue000'
+MARK_END = '\ue001'
+
+_pending = threading.local()
+
+
+def terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def recipe_id_column():
+    quote = connection.ops.quote_name
+    return f'{quote(Recipe._meta.db_table)}.{quote("id")}'
+
+
+class PostgresEngine:
+    # Словарь и веса совпадают со столбцом vector из миграции 0013.
+    config = 'russian'
+    table = 'recipes_recipesearchdocument'
+    name_options = (
+        f'StartSel={MARK_START}, StopSel={MARK_END}, HighlightAll=1'
+    )
+    text_options = (
+        f'StartSel={MARK_START}, StopSel={MARK_END}, '
+        'MaxFragments=2, MaxWords=20, MinWords=8'
+    )
+
+    @staticmethod
+    def query(words):
+        return ' & '.join(f'{word}:*' for word in words)
+
+    def matches(self, query):
+        return (
+            f'SELECT recipe_id FROM {self.table} '
+            f"WHERE vector @@ to_tsquery('{self.config}', %s)",
+            (query,)
+        )
+
+    def lookup(self, expression, params):
+        return (
+            f'SELECT {expression} FROM {self.table} '
+            f'WHERE recipe_id = {recipe_id_column()}',
+            params
+        )
+
+    def rank(self, query):
+        return self.lookup(
+            f"ts_rank_cd(vector, to_tsquery('{self.config}', %s))::float8",
+            (query,)
+        )
+
+    def highlight(self, column, query):
+        options = self.name_options if column == 'name' else self.text_options
+        return self.lookup(
+            f"ts_headline('{self.config}', {column}, "
+            f"to_tsquery('{self.config}', %s), %s)",
+            (query, options)
+        )
+
+
+class SqliteEngine:
+    # Столбцы FTS5-таблицы: name, text, ingredients, tags.
+    table = 'recipes_recipe_fts'
+    weights = '10.0, 1.0, 4.0, 4.0'
+
+    @staticmethod
+    def query(words):
+        return ' '.join(f'"{word}"*' for word in words)
+
+    def matches(self, query):
+        return (
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s',
+            (query,)
+        )
+
+    def lookup(self, expression, params, query):
+        return (
+            f'SELECT {expression} FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND rowid = {recipe_id_column()}',
+            (*params, query)
+        )
+
+    def rank(self, query):
+        return self.lookup(f'-bm25({self.table}, {self.weights})', (), query)
+
+    def highlight(self, column, query):
+        if column == 'name':
+            expression = f'highlight({self.table}, 0, %s, %s)'
+        else:
+            expression = f"snippet({self.table}, 1, %s, %s, '…', 16)"
+        return self.lookup(expression, (MARK_START, MARK_END), query)
+
+
+ENGINES = {
+    'postgresql': PostgresEngine(),
+    'sqlite': SqliteEngine(),
+}
+
+
+def search(queryset, value):
+    words = terms(value)
+    if not words:
+        return queryset.none()
+    engine = ENGINES[connection.vendor]
+    query = engine.query(words)
+    return queryset.filter(id__in=RawSQL(*engine.matches(query))).annotate(
+        search_rank=RawSQL(*engine.rank(query), output_field=FloatField()),
+        search_name=RawSQL(
+            *engine.highlight('name', query), output_field=TextField()
+        ),
+        search_text=RawSQL(
+            *engine.highlight('text', query), output_field=TextField()
+        ),
+    )
+
+
+def mark(value):
+    return html.escape(value or '').replace(
+        MARK_START, '<mark>'
+    ).replace(MARK_END, '</mark>')
+
+
+def reindex(recipe_ids):
+    # Как и кэш, документы пересобираются после коммита и одной пачкой
+    # на транзакцию.
+    pending = getattr(_pending, 'ids', None)
+    if pending is None:
+        pending = _pending.ids = set()
+    pending.update(recipe_ids)
+    transaction.on_commit(flush)
+
+
+def flush():
+    recipe_ids = getattr(_pending, 'ids', None)
+    if not recipe_ids:
+        return
+    _pending.ids = set()
+    RecipeSearchDocument.objects.rebuild(recipe_ids)
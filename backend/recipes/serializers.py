@@ -1,42 +1,53 @@
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
-from drf_base64.fields import Base64ImageField
-from django.db import transaction
-
-from users.models import Follow
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
+
+from . import cache as recipe_cache
+from . import similarity
+from .fields import Base64ImageField
+from .images import rendition_urls
+from .relations import get_relations
+from .search import mark
+from .timing import TimedSerializerMixin, span
 from .models import (
-    Favorite, Ingredient, Recipe, ShoppingCart, Tag, IngredientRecipe
+    Ingredient, Recipe, ShoppingListItem, Tag, IngredientRecipe
 )
 from .models import User
 
+MAX_BULK_RECIPES = 100
+MAX_COOKABLE_INGREDIENTS = 50
+MAX_SIMILAR_RECIPES = 30
+
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         fields = ('id', 'name', 'measurement_unit')
         model = Ingredient
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         fields = ('id', 'name', 'color', 'slug')
         model = Tag
 
 
-class AuthorSerializer(serializers.ModelSerializer):
+class AuthorProfileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ('email', 'id', 'username', 'first_name', 'last_name')
+
+
+class AuthorSerializer(AuthorProfileSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if request.user.is_anonymous:
-            return False
-        return Follow.objects.filter(user=request.user, author=obj.pk).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return get_relations(self.context).is_subscribed(obj.pk)
 
-    class Meta:
-        model = User
-        fields = (
-            'email', 'id', 'username', 'first_name', 'last_name',
-            'is_subscribed'
-        )
+    class Meta(AuthorProfileSerializer.Meta):
+        fields = AuthorProfileSerializer.Meta.fields + ('is_subscribed',)
 
 
 class IngredientRecipeSerializer(serializers.ModelSerializer):
@@ -59,30 +70,116 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         ]
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
-    author = AuthorSerializer(read_only=True)
+class RecipeCacheSerializer(serializers.ModelSerializer):
+    # Часть рецепта, одинаковая для всех пользователей; хранится в кэше.
+    author = AuthorProfileSerializer(read_only=True)
     ingredients = serializers.SerializerMethodField()
     tags = TagSerializer(many=True)
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    images = serializers.SerializerMethodField()
 
     def get_ingredients(self, obj):
-        queryset = IngredientRecipe.objects.filter(recipe=obj)
+        queryset = obj.ingredient_recipe.all()
         return IngredientRecipeSerializer(queryset, many=True).data
 
+    def get_images(self, obj):
+        return rendition_urls(obj, self.context.get('request'))
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'id',
+            'tags',
+            'author',
+            'ingredients',
+            'name',
+            'image',
+            'images',
+            'text',
+            'cooking_time'
+        )
+
+
+class CachedRecipeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        if isinstance(data, models.manager.BaseManager):
+            data = data.all()
+        return self.child.cached_representation(list(data))
+
+
+class RecipeListSerializer(RecipeCacheSerializer):
+    author = AuthorSerializer(read_only=True)
+    is_favorited = serializers.SerializerMethodField()
+    is_in_shopping_cart = serializers.SerializerMethodField()
+
+    def to_representation(self, instance):
+        return self.cached_representation([instance])[0]
+
+    def cached_representation(self, recipes):
+        with span('serializer'):
+            if not self.context.get('use_cache', True):
+                to_representation = super().to_representation
+                return [to_representation(recipe) for recipe in recipes]
+            payloads = recipe_cache.get_many(recipes, self.build_payloads)
+            return [
+                self.add_viewer_fields(recipe, payload)
+                for recipe, payload in zip(recipes, payloads)
+            ]
+
+    @staticmethod
+    def build_payloads(recipes):
+        prefetch_related_objects(recipes, *Recipe.objects.related_lookups())
+        serializer = RecipeCacheSerializer()
+        return [serializer.to_representation(recipe) for recipe in recipes]
+
+    def add_viewer_fields(self, recipe, payload):
+        request = self.context.get('request')
+        data = dict(payload)
+        data['author'] = dict(
+            payload['author'], is_subscribed=self.get_author_subscribed(recipe)
+        )
+        data['is_favorited'] = self.get_is_favorited(recipe)
+        data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(recipe)
+        if request is not None and data['image']:
+            data['image'] = request.build_absolute_uri(data['image'])
+        if request is not None and data['images']:
+            data['images'] = {
+                name: {
+                    extension: request.build_absolute_uri(location)
+                    for extension, location in formats.items()
+                }
+                for name, formats in data['images'].items()
+            }
+        fields = {name: data[name] for name in self.Meta.fields}
+        if hasattr(recipe, 'search_rank'):
+            fields['search'] = {
+                'rank': recipe.search_rank,
+                'name': mark(recipe.search_name),
+                'text': mark(recipe.search_text),
+            }
+        if hasattr(recipe, 'similarity'):
+            fields['similarity'] = recipe.similarity
+        if hasattr(recipe, 'coverage'):
+            fields['coverage'] = {
+                'available': recipe.available,
+                'missing': recipe.missing,
+                'ratio': recipe.coverage,
+            }
+        return fields
+
+    def get_author_subscribed(self, obj):
+        if hasattr(obj, 'author_is_subscribed'):
+            return obj.author_is_subscribed
+        return get_relations(self.context).is_subscribed(obj.author_id)
+
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return Favorite.objects.filter(user=user.id, recipe=obj.id).exists()
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return get_relations(self.context).is_favorited(obj.pk)
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return ShoppingCart.objects.filter(
-            user=user.id, recipe=obj.id
-        ).exists()
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return get_relations(self.context).is_in_shopping_cart(obj.pk)
 
     class Meta:
         model = Recipe
@@ -95,13 +192,17 @@ class RecipeListSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time'
         )
+        list_serializer_class = CachedRecipeListSerializer
 
 
 class IngredientCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    # Ингредиенты всего рецепта ищутся одним запросом в
+    # RecipeSerializer.validate_ingredients.
+    id = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = IngredientRecipe
@@ -118,8 +219,13 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         request = self.context.get('request')
+        # Ответ на запись собирается без кэша: новая версия рецепта
+        # появляется только после коммита.
+        prefetch_related_objects(
+            [instance], *Recipe.objects.related_lookups()
+        )
         serializer = RecipeListSerializer(
-            instance, context={'request': request}
+            instance, context={'request': request, 'use_cache': False}
         )
         return serializer.data
 
@@ -127,7 +233,7 @@ class RecipeSerializer(serializers.ModelSerializer):
         unique_ingredients = set()
 
         for ingredient_data in value:
-            ingredient_id = ingredient_data.get('id').id
+            ingredient_id = ingredient_data.get('id')
 
             if ingredient_id in unique_ingredients:
                 raise serializers.ValidationError(
@@ -136,71 +242,116 @@ class RecipeSerializer(serializers.ModelSerializer):
             else:
                 unique_ingredients.add(ingredient_id)
 
+        ingredients = Ingredient.objects.in_bulk(unique_ingredients)
+        missing = sorted(unique_ingredients - ingredients.keys())
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: '
+                + ', '.join(str(ingredient_id) for ingredient_id in missing)
+            )
+
+        for ingredient_data in value:
+            ingredient_data['ingredient'] = ingredients[ingredient_data['id']]
+
         return value
 
-    def create(self, validated_data):
-        ingredients_data = validated_data.pop('ingredients', None)
-        tags = validated_data.pop('tags', None)
+    def validate(self, data):
+        # Проверяется до любой записи, в том числе при PATCH.
+        if not data.get('ingredients'):
+            raise serializers.ValidationError(
+                {'ingredients': 'Нужен хотя бы один ингредиент'}
+            )
+        if not data.get('tags'):
+            raise serializers.ValidationError(
+                {'tags': 'Нужен хотя бы один тег'}
+            )
+        return data
 
-        if not ingredients_data:
-            raise serializers.ValidationError('Нужен хотя бы один ингредиент')
-        if not tags:
-            raise serializers.ValidationError('Нужен хотя бы один тег')
+    def create(self, validated_data):
+        ingredients_data = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags')
 
         with transaction.atomic():
-            self.validate_ingredients(ingredients_data)
-
-            recipe = Recipe.objects.create(**validated_data)
+            recipe = Recipe.objects.create(
+                **validated_data, ingredients_count=len(ingredients_data)
+            )
             recipe.tags.set(tags)
 
             ingredients_list = []
 
             for ingredient_data in ingredients_data:
-                amount = ingredient_data.get('amount')
-                ingredient_id = ingredient_data.get('id').id
-                ingredient = Ingredient.objects.get(id=ingredient_id)
-
                 ingredients_list.append(
                     IngredientRecipe(
-                        recipe=recipe, ingredient=ingredient, amount=amount
+                        recipe=recipe,
+                        ingredient=ingredient_data['ingredient'],
+                        amount=ingredient_data.get('amount')
                     )
                 )
 
             IngredientRecipe.objects.bulk_create(ingredients_list)
+            similarity.index(
+                {recipe.id: [row.ingredient_id for row in ingredients_list]},
+                replace=False
+            )
 
         return recipe
 
     def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop('ingredients', None)
-        tags = validated_data.pop('tags', None)
+        ingredients_data = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags')
+        validated_data['ingredients_count'] = len(ingredients_data)
 
-        instance = super().update(instance, validated_data)
-
-        if not ingredients_data:
-            raise serializers.ValidationError('Нужен хотя бы один ингредиент')
-        if not tags:
-            raise serializers.ValidationError('Нужен хотя бы один тег')
-
-        self.validate_ingredients(ingredients_data)
-
-        instance.tags.set(tags)
-        IngredientRecipe.objects.filter(recipe=instance).delete()
+        with transaction.atomic():
+            instance = super().update(instance, validated_data)
+            instance.tags.set(tags)
+            self.update_ingredients(instance, ingredients_data)
 
-        ingredients_list = []
+        return instance
 
-        for ingredient_data in ingredients_data:
-            amount = ingredient_data.get('amount')
-            ingredient_id = ingredient_data.get('id').id
-            ingredient = Ingredient.objects.get(id=ingredient_id)
-            ingredients_list.append(
-                IngredientRecipe(
-                    recipe=instance, ingredient=ingredient, amount=amount
-                )
+    @staticmethod
+    def update_ingredients(recipe, ingredients_data):
+        existing = {
+            row.ingredient_id: row
+            for row in IngredientRecipe.objects.filter(recipe=recipe)
+        }
+        amounts = {
+            ingredient_data['ingredient'].id: ingredient_data.get('amount')
+            for ingredient_data in ingredients_data
+        }
+
+        to_update = []
+        for ingredient_id, row in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                to_update.append(row)
+        to_create = [
+            IngredientRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
             )
-
-        IngredientRecipe.objects.bulk_create(ingredients_list)
-
-        return instance
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ]
+        to_delete = [
+            row.pk for ingredient_id, row in existing.items()
+            if ingredient_id not in amounts
+        ]
+        if not (to_update or to_create or to_delete):
+            return
+
+        # Списки покупок пересчитываются по старому и новому составу только
+        # если состав действительно изменился.
+        cart_user_ids = list(recipe.cart.values_list('user_id', flat=True))
+        ShoppingListItem.objects.apply_recipe(recipe, cart_user_ids, -1)
+        if to_delete:
+            IngredientRecipe.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            IngredientRecipe.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            IngredientRecipe.objects.bulk_create(to_create)
+        if to_create or to_delete:
+            similarity.index({recipe.id: list(amounts)})
+        ShoppingListItem.objects.apply_recipe(recipe, cart_user_ids, 1)
 
     class Meta:
         model = Recipe
@@ -216,7 +367,36 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
 
 
-class FollowRecipeSerializer(serializers.ModelSerializer):
+class RecipeIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES
+    )
+
+
+class CookableSerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_COOKABLE_INGREDIENTS
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+
+class SimilarSerializer(serializers.Serializer):
+    limit = serializers.IntegerField(
+        min_value=1, max_value=MAX_SIMILAR_RECIPES, default=6
+    )
+
+
+class FollowRecipeSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
+    images = serializers.SerializerMethodField()
+
+    def get_images(self, obj):
+        return rendition_urls(obj, self.context.get('request'))
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
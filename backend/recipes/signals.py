@@ -0,0 +1,130 @@
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from users.models import Follow, User
+from . import cache as recipe_cache
+from . import images
+from . import search
+from .models import (
+    ContentVersion,
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    ShoppingListItem,
+    Tag,
+    relations_changed,
+)
+
+# Версию 'recipes' поднимает recipes.cache после коммита, один раз на
+# транзакцию, вместе с версиями закэшированных рецептов: так её меняет
+# любая правка рецепта, его ингредиентов, тегов или автора. У избранного,
+# корзины и подписок версии свои у каждого пользователя (user_content),
+# так что вход пользователя и чужие действия валидаторы не сбрасывают.
+VERSIONED_MODELS = {
+    Tag: 'tags',
+    Ingredient: 'ingredients',
+}
+
+
+# Поля пользователя, которые попадают в закэшированный рецепт.
+AUTHOR_PROFILE_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+def recipes_changed(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    recipe_cache.invalidate(recipe_ids)
+    search.reindex(recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe(sender, instance, created, **kwargs):
+    if created:
+        recipe_cache.invalidate()
+        search.reindex([instance.pk])
+    else:
+        recipes_changed([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_list(sender, instance, **kwargs):
+    recipe_cache.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(sender, instance, **kwargs):
+    if images.needs_processing(instance):
+        images.schedule(instance)
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def invalidate_recipe_ingredients(sender, instance, **kwargs):
+    recipes_changed([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        recipes_changed([instance.pk])
+    elif pk_set:
+        recipes_changed(pk_set)
+    else:
+        recipes_changed(instance.recipes.values_list('id', flat=True))
+
+
+@receiver((post_save, pre_delete), sender=Tag)
+@receiver((post_save, pre_delete), sender=Ingredient)
+def invalidate_related_recipes(sender, instance, **kwargs):
+    if not kwargs.get('created'):
+        recipes_changed(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_recipes(sender, instance, created, update_fields,
+                              **kwargs):
+    # Вход пользователя сохраняет только last_login.
+    if created or (
+        update_fields is not None
+        and not AUTHOR_PROFILE_FIELDS & set(update_fields)
+    ):
+        return
+    recipe_cache.invalidate(instance.recipes.values_list('id', flat=True))
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def forget_follows(sender, instance, **kwargs):
+    relations_changed('follows', instance.user_id)
+
+
+@receiver(pre_delete, sender=Recipe)
+def release_shopping_lists(sender, instance, **kwargs):
+    # Корзины удаляются вместе с рецептом каскадом (из API, из админки или
+    # с аккаунтом автора), поэтому ингредиенты рецепта вычитаются из
+    # списков покупок заранее, пока строки корзины ещё на месте.
+    ShoppingListItem.objects.apply_recipe(
+        instance, instance.cart.values_list('user_id', flat=True), -1
+    )
+
+
+@receiver(pre_delete, sender=User)
+def release_recipe_counters(sender, instance, **kwargs):
+    Favorite.objects.release_user(instance)
+    ShoppingCart.objects.release_user(instance)
+
+
+def bump_content_version(sender, **kwargs):
+    ContentVersion.objects.bump(VERSIONED_MODELS[sender])
+
+
+for model in VERSIONED_MODELS:
+    post_save.connect(bump_content_version, sender=model)
+    post_delete.connect(bump_content_version, sender=model)
@@ -0,0 +1,158 @@
+import hashlib
+import random
+import struct
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import (
+    IngredientRecipe,
+    Recipe,
+    RecipeBucket,
+    RecipeSignature,
+)
+
+# 16 полос по 4 строки: пара рецептов попадает в общую корзину хотя бы
+# одной полосы с вероятностью 1 - (1 - J^4)^16, то есть почти наверняка
+# при сходстве по Жаккару от 0.5 и редко при сходстве ниже 0.3.
+BANDS = 16
+ROWS = 4
+PERMUTATIONS = BANDS * ROWS
+PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+SIGNATURE_FORMAT = f'<{PERMUTATIONS}I'
+# Коэффициенты хэш-функций фиксированы: подписи, посчитанные разными
+# процессами и в разное время, должны быть сравнимы.
+_random = random.Random(20231018)
+COEFFICIENTS = [
+    (_random.randrange(1, PRIME), _random.randrange(0, PRIME))
+    for _ in range(PERMUTATIONS)
+]
+MAX_CANDIDATES = 500
+# Вклад общих тегов в оценку: доля общих тегов весит как 0.2 Жаккара.
+TAGS_WEIGHT = 0.2
+
+
+def signature(ingredient_ids):
+    return tuple(
+        min((a * value + b) % PRIME for value in ingredient_ids) & MAX_HASH
+        for a, b in COEFFICIENTS
+    )
+
+
+def pack(values):
+    # Порядок байтов фиксирован, подписи и корзины не зависят от
+    # архитектуры сервера.
+    return struct.pack(SIGNATURE_FORMAT, *values)
+
+
+def unpack(data):
+    return struct.unpack(SIGNATURE_FORMAT, bytes(data))
+
+
+def buckets(values):
+    data = pack(values)
+    size = ROWS * struct.calcsize('<I')
+    for band in range(BANDS):
+        rows = data[band * size:(band + 1) * size]
+        digest = hashlib.blake2b(rows, digest_size=8).digest()
+        yield band, int.from_bytes(digest, 'big', signed=True)
+
+
+def jaccard(left, right):
+    return sum(a == b for a, b in zip(left, right)) / PERMUTATIONS
+
+
+def update(recipe_ids):
+    # Подписи пересчитываются целиком по текущему составу рецептов; рецепт
+    # без ингредиентов просто выпадает из индекса.
+    ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+    for recipe_id, ingredient_id in IngredientRecipe.objects.filter(
+        recipe_id__in=ingredients
+    ).values_list('recipe_id', 'ingredient_id').order_by().iterator():
+        ingredients[recipe_id].append(ingredient_id)
+    return index(ingredients)
+
+
+def index(ingredients, replace=True):
+    # ingredients: {id рецепта: id его ингредиентов}. replace=False — для
+    # только что созданных рецептов, у которых подписи ещё нет.
+    signatures = []
+    bucket_rows = []
+    for recipe_id, ingredient_ids in ingredients.items():
+        if not ingredient_ids:
+            continue
+        values = signature(ingredient_ids)
+        signatures.append(
+            RecipeSignature(recipe_id=recipe_id, signature=pack(values))
+        )
+        bucket_rows.extend(
+            RecipeBucket(recipe_id=recipe_id, band=band, bucket=bucket)
+            for band, bucket in buckets(values)
+        )
+
+    with transaction.atomic(savepoint=False):
+        if replace:
+            RecipeSignature.objects.filter(recipe_id__in=ingredients).delete()
+            RecipeBucket.objects.filter(recipe_id__in=ingredients).delete()
+        RecipeSignature.objects.bulk_create(signatures, batch_size=500)
+        RecipeBucket.objects.bulk_create(bucket_rows, batch_size=1000)
+    return len(signatures)
+
+
+def similar(recipe, limit):
+    # Возвращает [(id рецепта, оценка Жаккара, число общих тегов)] по
+    # убыванию сходства. Кандидаты — только рецепты из общих корзин LSH.
+    try:
+        values = unpack(recipe.signature.signature)
+    except RecipeSignature.DoesNotExist:
+        return []
+
+    same_bucket = Q()
+    for band, bucket in buckets(values):
+        same_bucket |= Q(band=band, bucket=bucket)
+    candidate_ids = list(
+        RecipeBucket.objects.filter(same_bucket)
+        .exclude(recipe_id=recipe.id)
+        .values('recipe_id')
+        .annotate(bands=Count('pk'))
+        .order_by('-bands', '-recipe_id')
+        .values_list('recipe_id', flat=True)[:MAX_CANDIDATES]
+    )
+    if not candidate_ids:
+        return []
+
+    scores = {
+        recipe_id: jaccard(values, unpack(data))
+        for recipe_id, data in RecipeSignature.objects.filter(
+            recipe_id__in=candidate_ids
+        ).values_list('recipe_id', 'signature')
+    }
+    tags = Recipe.tags.through.objects
+    own_tags = list(
+        tags.filter(recipe_id=recipe.id).values_list('tag_id', flat=True)
+    )
+    shared_tags = dict(
+        tags.filter(recipe_id__in=candidate_ids, tag_id__in=own_tags)
+        .values('recipe_id')
+        .annotate(shared=Count('pk'))
+        .values_list('recipe_id', 'shared')
+        .order_by()
+    )
+    tags_count = max(len(own_tags), 1)
+
+    ranked = sorted(
+        (
+            (
+                score + TAGS_WEIGHT * shared_tags.get(recipe_id, 0)
+                / tags_count,
+                recipe_id,
+            )
+            for recipe_id, score in scores.items()
+        ),
+        reverse=True
+    )[:limit]
+    return [
+        (recipe_id, scores[recipe_id], shared_tags.get(recipe_id, 0))
+        for _, recipe_id in ranked
+    ]
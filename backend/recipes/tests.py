@@ -0,0 +1,638 @@
+import base64
+import shutil
+import tempfile
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import (
+    APIClient,
+    APITestCase,
+    APITransactionTestCase,
+)
+
+from recipes import cache as recipe_cache
+from recipes import images, ranking
+from recipes.fields import Base64ImageField
+from recipes.management.commands.benchmark_api import BUDGETS
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    ShoppingCart,
+    ShoppingListItem,
+    Tag,
+)
+from users.models import Follow, User
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+class RecipeAPIMixin:
+    @classmethod
+    def create_test_data(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author', password='!',
+            first_name='Автор', last_name='Рецептов'
+        )
+        cls.reader = User.objects.create_user(
+            email='reader@example.com', username='reader', password='!',
+            first_name='Читатель', last_name='Рецептов'
+        )
+        cls.tags = Tag.objects.bulk_create(
+            Tag(name=name, slug=slug, color=color)
+            for name, slug, color in (
+                ('Завтрак', 'breakfast', '#E26C2D'),
+                ('Обед', 'lunch', '#49B64E'),
+                ('Ужин', 'dinner', '#8775D2'),
+            )
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in (
+                'картофель', 'морковь', 'свёкла', 'капуста', 'лук',
+                'чеснок', 'мука', 'сахар', 'яйца', 'молоко', 'соль',
+                'перец',
+            )
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.author_client = self.client_for(self.author)
+        self.reader_client = self.client_for(self.reader)
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    @contextmanager
+    def committed(self):
+        # Кэш, поисковые документы и версии обновляются после коммита.
+        with self.captureOnCommitCallbacks(execute=True):
+            yield
+
+    def recipe_payload(self, name, ingredients, tags=None, text='Описание'):
+        return {
+            'name': name,
+            'text': text,
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [tag.id for tag in tags or self.tags[:1]],
+            'ingredients': [
+                {'id': self.ingredients[index].id, 'amount': amount}
+                for index, amount in ingredients
+            ],
+        }
+
+    def create_recipe(self, name, ingredients=((0, 100),), **kwargs):
+        with self.committed():
+            response = self.author_client.post(
+                '/api/recipes/',
+                self.recipe_payload(name, ingredients, **kwargs),
+                format='json'
+            )
+        self.assertEqual(
+            response.status_code, status.HTTP_201_CREATED, response.data
+        )
+        return response.data['id']
+
+    def request(self, client, method, url, data=None):
+        with self.committed():
+            return getattr(client, method)(url, data, format='json')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_WORKERS=0)
+class RecipeAPITestCase(RecipeAPIMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_test_data()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_WORKERS=0)
+class QueryBudgetTests(RecipeAPIMixin, APITransactionTestCase):
+    # Те же бюджеты, что проверяет benchmark_api, и в тех же условиях: без
+    # общей транзакции теста (BEGIN и COMMIT тоже считаются), чтение
+    # замеряется повторным запросом (кэш прогрет), запись — одним.
+    # assertNumQueries требует точного совпадения, так что и лишний, и
+    # сэкономленный запрос требуют поправить BUDGETS.
+    def setUp(self):
+        self.create_test_data()
+        super().setUp()
+        self.cook = User.objects.create_user(
+            email='cook@example.com', username='cook', password='!',
+            first_name='Повар', last_name='Рецептов'
+        )
+        # Рецепты идут парами с одинаковым составом: у похожих рецептов
+        # всегда есть кандидаты.
+        recipe_ids = [
+            self.create_recipe(
+                f'Рецепт {index}',
+                ((index // 2 % 12, 10), ((index // 2 + 1) % 12, 20)),
+                tags=self.tags[:2]
+            )
+            for index in range(10, 24)
+        ]
+        Favorite.objects.add(self.reader, recipe_ids[::3])
+        ShoppingCart.objects.add(self.reader, recipe_ids[1::3])
+        ShoppingListItem.objects.rebuild([self.reader.id])
+        Follow.objects.create(user=self.reader, author=self.author)
+        for feed in ranking.FEEDS:
+            ranking.refresh(feed)
+        # Рецепт не в избранном и не в корзине читателя.
+        self.recipe_id = recipe_ids[2]
+        self.free_ids = recipe_ids[2::3]
+
+    @contextmanager
+    def committed(self):
+        # Без общей транзакции колбэки on_commit выполняются сразу.
+        yield
+
+    def assertBudget(self, name, call):
+        with self.assertNumQueries(BUDGETS[name][0]):
+            with self.committed():
+                response = call()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400)
+        return response
+
+    def test_read_routes(self):
+        ingredients = ','.join(
+            str(ingredient.id) for ingredient in self.ingredients[:10]
+        )
+        pages = Recipe.objects.count() // settings.REST_FRAMEWORK['PAGE_SIZE']
+        for name, url in (
+            ('recipes-list', '/api/recipes/'),
+            ('recipes-list-deep-page', f'/api/recipes/?page={pages}'),
+            ('recipes-list-cursor', '/api/recipes/?cursor='),
+            (
+                'recipes-list-popular',
+                '/api/recipes/?ordering=-favorites_count',
+            ),
+            ('recipes-popular', '/api/recipes/popular/'),
+            ('recipes-trending-cursor', '/api/recipes/trending/?cursor='),
+            (
+                'recipes-list-filtered',
+                '/api/recipes/?tags=breakfast&tags=lunch&is_favorited=1',
+            ),
+            ('recipes-search', '/api/recipes/?search=рецепт 12'),
+            (
+                'recipes-what-to-cook',
+                f'/api/recipes/what_to_cook/?ingredients={ingredients}',
+            ),
+            ('recipes-similar', f'/api/recipes/{self.recipe_id}/similar/'),
+            ('recipes-detail', f'/api/recipes/{self.recipe_id}/'),
+            (
+                'recipes-download-shopping-cart',
+                '/api/recipes/download_shopping_cart/',
+            ),
+            ('tags-list', '/api/tags/'),
+            ('ingredients-search', '/api/ingredients/?name=ка'),
+            ('users-list', '/api/users/'),
+            (
+                'users-subscriptions',
+                '/api/users/subscriptions/?recipes_limit=3',
+            ),
+        ):
+            with self.subTest(name=name):
+                response = self.reader_client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                self.assertBudget(name, partial(self.reader_client.get, url))
+
+    def test_write_routes(self):
+        payload = self.recipe_payload(
+            'Новый рецепт', [(index, 10) for index in range(10)], self.tags
+        )
+        response = self.assertBudget('recipes-create', partial(
+            self.author_client.post, '/api/recipes/', payload, format='json'
+        ))
+        self.assertBudget('recipes-update', partial(
+            self.author_client.patch, f'/api/recipes/{response.data["id"]}/',
+            {**payload, 'ingredients': payload['ingredients'][:5]},
+            format='json'
+        ))
+
+        for name, url in (
+            ('recipes-favorite', f'/api/recipes/{self.recipe_id}/favorite/'),
+            (
+                'recipes-shopping-cart',
+                f'/api/recipes/{self.recipe_id}/shopping_cart/',
+            ),
+        ):
+            with self.subTest(name=name):
+                self.assertBudget(
+                    f'{name}-add', partial(self.reader_client.post, url)
+                )
+                self.assertBudget(
+                    f'{name}-remove', partial(self.reader_client.delete, url)
+                )
+
+        ids = {'ids': self.free_ids}
+        for name, url in (
+            ('recipes-favorite-bulk', '/api/recipes/favorite/'),
+            ('recipes-shopping-cart-bulk', '/api/recipes/shopping_cart/'),
+        ):
+            with self.subTest(name=name):
+                self.assertBudget(f'{name}-add', partial(
+                    self.reader_client.post, url, ids, format='json'
+                ))
+                self.assertBudget(f'{name}-remove', partial(
+                    self.reader_client.delete, url, ids, format='json'
+                ))
+
+        url = f'/api/users/{self.cook.id}/subscribe/'
+        self.assertBudget(
+            'users-subscribe', partial(self.reader_client.post, url)
+        )
+        self.assertBudget(
+            'users-unsubscribe', partial(self.reader_client.delete, url)
+        )
+
+    def count_queries(self, call):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            with self.committed():
+                response = call()
+        self.assertLess(response.status_code, 400, response.content)
+        return len(context)
+
+    def test_list_does_not_grow_with_page_size(self):
+        self.assertEqual(*(
+            self.count_queries(
+                partial(self.reader_client.get, f'/api/recipes/?limit={size}')
+            )
+            for size in (2, 12)
+        ))
+
+    def test_create_does_not_grow_with_ingredients(self):
+        self.assertEqual(*(
+            self.count_queries(partial(
+                self.author_client.post, '/api/recipes/',
+                self.recipe_payload(
+                    name, [(index, 10) for index in range(size)]
+                ),
+                format='json'
+            ))
+            for name, size in (('Короткий', 2), ('Длинный', 10))
+        ))
+
+
+class BulkToggleTests(RecipeAPITestCase):
+    def test_statuses(self):
+        first = self.create_recipe('Первый')
+        second = self.create_recipe('Второй')
+        missing = second + 100
+        Favorite.objects.add(self.reader, [first])
+
+        response = self.request(
+            self.reader_client, 'post', '/api/recipes/favorite/',
+            {'ids': [first, second, missing, second]}
+        )
+        self.assertEqual(response.data['results'], [
+            {'id': first, 'status': 'already_in'},
+            {'id': second, 'status': 'added'},
+            {'id': missing, 'status': 'not_found'},
+        ])
+        self.assertEqual(
+            Recipe.objects.get(id=second).favorites_count, 1
+        )
+
+        response = self.request(
+            self.reader_client, 'delete', '/api/recipes/favorite/',
+            {'ids': [first, missing]}
+        )
+        self.assertEqual(response.data['results'], [
+            {'id': first, 'status': 'removed'},
+            {'id': missing, 'status': 'not_found'},
+        ])
+        response = self.request(
+            self.reader_client, 'delete', '/api/recipes/favorite/',
+            {'ids': [first]}
+        )
+        self.assertEqual(
+            response.data['results'], [{'id': first, 'status': 'not_in'}]
+        )
+        self.assertEqual(
+            list(Favorite.objects.values_list('recipe_id', flat=True)),
+            [second]
+        )
+
+    def test_cart_updates_shopping_list(self):
+        recipe_ids = [
+            self.create_recipe('Первый', ((0, 100), (1, 50))),
+            self.create_recipe('Второй', ((0, 30),)),
+        ]
+        self.request(
+            self.reader_client, 'post', '/api/recipes/shopping_cart/',
+            {'ids': recipe_ids}
+        )
+        self.assertEqual(self.shopping_list(), {
+            self.ingredients[0].id: 130, self.ingredients[1].id: 50
+        })
+
+    def shopping_list(self):
+        return dict(
+            ShoppingListItem.objects.filter(user=self.reader)
+            .values_list('ingredient_id', 'amount')
+        )
+
+
+class KeysetPaginationTests(RecipeAPITestCase):
+    def test_walks_feed_both_ways(self):
+        recipe_ids = [
+            self.create_recipe(f'Рецепт {index}') for index in range(7)
+        ]
+        pages = []
+        url = '/api/recipes/?cursor=&limit=3'
+        while url:
+            response = self.reader_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data)
+            url = response.data['next']
+        self.assertEqual(
+            [recipe['id'] for page in pages for recipe in page['results']],
+            recipe_ids[::-1]
+        )
+        self.assertEqual([len(page['results']) for page in pages], [3, 3, 1])
+        self.assertIsNone(pages[0]['previous'])
+
+        response = self.reader_client.get(pages[2]['previous'])
+        self.assertEqual(response.data['results'], pages[1]['results'])
+
+    def test_rejects_broken_cursor(self):
+        response = self.reader_client.get('/api/recipes/?cursor=broken')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class WhatToCookTests(RecipeAPITestCase):
+    def test_ranks_by_coverage(self):
+        full = self.create_recipe('Всё есть', ((0, 1), (1, 1)))
+        half = self.create_recipe('Половина', ((0, 1), (2, 1)))
+        self.create_recipe('Ничего', ((3, 1),))
+
+        ingredients = f'{self.ingredients[0].id},{self.ingredients[1].id}'
+        response = self.reader_client.get(
+            f'/api/recipes/what_to_cook/?ingredients={ingredients}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [
+                (recipe['id'], recipe['coverage'])
+                for recipe in response.data['results']
+            ],
+            [
+                (full, {'available': 2, 'missing': 0, 'ratio': 1.0}),
+                (half, {'available': 1, 'missing': 1, 'ratio': 0.5}),
+            ]
+        )
+
+        response = self.reader_client.get(
+            f'/api/recipes/what_to_cook/?ingredients={ingredients}'
+            '&max_missing=0'
+        )
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']], [full]
+        )
+
+    def test_requires_ingredients(self):
+        response = self.reader_client.get('/api/recipes/what_to_cook/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SimilarTests(RecipeAPITestCase):
+    def test_finds_recipes_with_same_ingredients(self):
+        ingredients = ((0, 1), (1, 1), (2, 1), (3, 1))
+        recipe = self.create_recipe('Борщ', ingredients)
+        twin = self.create_recipe('Борщ постный', ingredients)
+        self.create_recipe('Омлет', ((8, 1), (9, 1), (10, 1)))
+
+        response = self.reader_client.get(f'/api/recipes/{recipe}/similar/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['id'], item['similarity']) for item in response.data],
+            [(twin, {'jaccard': 1.0, 'shared_tags': 1})]
+        )
+
+    def test_follows_ingredient_changes(self):
+        recipe = self.create_recipe('Борщ', ((0, 1), (1, 1), (2, 1)))
+        other = self.create_recipe('Омлет', ((8, 1), (9, 1), (10, 1)))
+        self.request(
+            self.author_client, 'patch', f'/api/recipes/{other}/',
+            self.recipe_payload('Омлет', ((0, 1), (1, 1), (2, 1)))
+        )
+        response = self.reader_client.get(f'/api/recipes/{recipe}/similar/')
+        self.assertEqual([item['id'] for item in response.data], [other])
+
+
+class SearchTests(RecipeAPITestCase):
+    def test_matches_name_text_and_ingredients(self):
+        borscht = self.create_recipe(
+            'Борщ', ((2, 1),), text='Красный суп со сметаной'
+        )
+        soup = self.create_recipe(
+            'Щи', ((3, 1),), text='Суп из квашеной капусты'
+        )
+        self.create_recipe('Омлет', ((8, 1),), text='Яйца и молоко')
+
+        for query, expected in (
+            ('борщ', [borscht]),
+            ('свёк', [borscht]),
+            ('суп капуст', [soup]),
+            ('молоко борщ', []),
+        ):
+            with self.subTest(query=query):
+                response = self.reader_client.get(
+                    '/api/recipes/', {'search': query}
+                )
+                self.assertEqual(
+                    [recipe['id'] for recipe in response.data['results']],
+                    expected
+                )
+
+        response = self.reader_client.get('/api/recipes/?search=борщ')
+        found = response.data['results'][0]['search']
+        self.assertEqual(found['name'], '<mark>Борщ</mark>')
+        self.assertGreater(found['rank'], 0)
+
+    def test_name_outranks_text(self):
+        in_text = self.create_recipe('Суп', text='Почти как борщ')
+        in_name = self.create_recipe('Борщ', text='Красный суп')
+        response = self.reader_client.get('/api/recipes/?search=борщ')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [in_name, in_text]
+        )
+
+    def test_follows_renames(self):
+        recipe = self.create_recipe('Борщ')
+        self.request(
+            self.author_client, 'patch', f'/api/recipes/{recipe}/',
+            self.recipe_payload('Солянка', ((0, 100),))
+        )
+        response = self.reader_client.get('/api/recipes/?search=борщ')
+        self.assertEqual(response.data['results'], [])
+
+
+class ConditionalGetTests(RecipeAPITestCase):
+    def get(self, client, url, etag=None):
+        if etag is None:
+            return client.get(url)
+        return client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_not_modified(self):
+        self.create_recipe('Борщ')
+        response = self.get(self.reader_client, '/api/recipes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.get(
+            self.reader_client, '/api/recipes/', response['ETag']
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_other_users_actions_keep_etag(self):
+        recipe = self.create_recipe('Борщ')
+        etag = self.get(self.reader_client, '/api/recipes/')['ETag']
+        self.request(
+            self.author_client, 'post', f'/api/recipes/{recipe}/favorite/'
+        )
+        self.author.save(update_fields=['last_login'])
+        response = self.get(self.reader_client, '/api/recipes/', etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.request(
+            self.reader_client, 'post', f'/api/recipes/{recipe}/favorite/'
+        )
+        response = self.get(self.reader_client, '/api/recipes/', etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['results'][0]['is_favorited'])
+
+    def test_recipe_changes_update_etag(self):
+        recipe = self.create_recipe('Борщ')
+        url = f'/api/recipes/{recipe}/'
+        etag = self.get(self.reader_client, url)['ETag']
+        self.request(
+            self.author_client, 'patch', url,
+            self.recipe_payload('Борщ', ((1, 100),))
+        )
+        response = self.get(self.reader_client, url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        with self.committed():
+            self.author.first_name = 'Повар'
+            self.author.save()
+        response = self.get(self.reader_client, url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['author']['first_name'], 'Повар')
+
+    def test_renditions_update_etag(self):
+        recipe = Recipe.objects.get(id=self.create_recipe('Борщ'))
+        with self.committed():
+            Recipe.objects.filter(id=recipe.id).update(image_renditions={})
+            recipe_cache.invalidate([recipe.id])
+        url = f'/api/recipes/{recipe.id}/'
+        response = self.get(APIClient(), url)
+        self.assertIsNone(response.data['images'])
+
+        with self.committed():
+            images.process(recipe.id, recipe.image.name)
+        response = self.get(APIClient(), url, response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(response.data['images'])
+
+
+class ShoppingListTests(RecipeAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.first = self.create_recipe('Первый', ((0, 100), (1, 50)))
+        self.second = self.create_recipe('Второй', ((0, 30), (2, 10)))
+        for recipe in (self.first, self.second):
+            self.request(
+                self.reader_client, 'post',
+                f'/api/recipes/{recipe}/shopping_cart/'
+            )
+
+    def shopping_list(self):
+        return {
+            Ingredient.objects.get(id=ingredient_id).name: amount
+            for ingredient_id, amount in ShoppingListItem.objects.filter(
+                user=self.reader
+            ).values_list('ingredient_id', 'amount')
+        }
+
+    def test_aggregates_cart(self):
+        self.assertEqual(
+            self.shopping_list(),
+            {'картофель': 130, 'морковь': 50, 'свёкла': 10}
+        )
+        response = self.reader_client.get(
+            '/api/recipes/download_shopping_cart/?format=txt'
+        )
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            '01. Картофель - 130 г\n02. Морковь - 50 г\n03. Свёкла - 10 г\n'
+        )
+
+    def test_follows_cart_and_recipe_changes(self):
+        self.request(
+            self.reader_client, 'delete',
+            f'/api/recipes/{self.second}/shopping_cart/'
+        )
+        self.assertEqual(
+            self.shopping_list(), {'картофель': 100, 'морковь': 50}
+        )
+        self.request(
+            self.author_client, 'patch', f'/api/recipes/{self.first}/',
+            self.recipe_payload('Первый', ((0, 10), (3, 5)))
+        )
+        self.assertEqual(
+            self.shopping_list(), {'картофель': 10, 'капуста': 5}
+        )
+
+    def test_recipe_deletion(self):
+        Recipe.objects.get(id=self.first).delete()
+        self.assertEqual(
+            self.shopping_list(), {'картофель': 30, 'свёкла': 10}
+        )
+        self.author.delete()
+        self.assertEqual(self.shopping_list(), {})
+
+
+class Base64ImageFieldTests(APITestCase):
+    def test_accepts_drf_base64_inputs(self):
+        payload = IMAGE.partition(',')[2]
+        wrapped = '\n'.join(
+            payload[start:start + 16] for start in range(0, len(payload), 16)
+        )
+        field = Base64ImageField()
+        for value in (
+            IMAGE, payload, wrapped, f'data:image/png;base64,{wrapped}'
+        ):
+            with self.subTest(value=value[:30]):
+                image = field.to_internal_value(value)
+                self.assertTrue(image.name.endswith('.png'))
+
+    def test_rejects_non_images(self):
+        field = Base64ImageField()
+        for value in ('', 'data:image/png;base64,@@@@',
+                      base64.b64encode(b'not an image').decode()):
+            with self.subTest(value=value):
+                with self.assertRaises(Exception):
+                    field.to_internal_value(value)
@@ -0,0 +1,172 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+REPEATED_SQL_LIMIT = 3
+SQL_PREVIEW_LENGTH = 200
+
+_local = threading.local()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.statements = Counter()
+        self.depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обёртка connection.execute_wrapper: одинаковый текст запроса с
+        # разными параметрами и есть признак N+1.
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.statements[sql] += 1
+
+    @property
+    def queries(self):
+        return sum(self.statements.values())
+
+    @property
+    def duplicates(self):
+        return sum(
+            count - 1 for count in self.statements.values() if count > 1
+        )
+
+    def repeated(self):
+        return [
+            {'sql': sql[:SQL_PREVIEW_LENGTH], 'count': count}
+            for sql, count in self.statements.most_common(REPEATED_SQL_LIMIT)
+            if count > 1
+        ]
+
+    def server_timing(self):
+        return ', '.join((
+            f'total;dur={self.total * 1000:.1f}',
+            f'db;dur={self.db * 1000:.1f};'
+            f'desc="{self.queries} queries, {self.duplicates} duplicate"',
+            f'serializer;dur={self.serializer * 1000:.1f}',
+        ))
+
+
+def current():
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def span(name):
+    # Вложенные сериализаторы не считаются повторно: время идёт только
+    # у внешнего.
+    timings = current()
+    if timings is None or timings.depth:
+        yield
+        return
+    timings.depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.depth -= 1
+        setattr(
+            timings, name,
+            getattr(timings, name) + time.perf_counter() - started
+        )
+
+
+class TimedSerializerMixin:
+    def to_representation(self, instance):
+        with span('serializer'):
+            return super().to_representation(instance)
+
+
+def view_name(view_func, request):
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__qualname__}'
+    actions = getattr(view_func, 'actions', None) or {}
+    method = request.method.lower()
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+@contextmanager
+def capture(timings):
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timings))
+        yield
+
+
+class RequestTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = request.timings = _local.timings = RequestTimings()
+        try:
+            with capture(timings):
+                response = self.get_response(request)
+        finally:
+            _local.timings = None
+        timings.total = time.perf_counter() - timings.started
+
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = timings.server_timing()
+        if response.streaming:
+            response.streaming_content = self.stream(
+                request, response, timings, response.streaming_content
+            )
+        else:
+            self.log(request, response, timings)
+        return response
+
+    def stream(self, request, response, timings, content):
+        # Тело StreamingHttpResponse (выгрузка списка покупок) читает базу
+        # уже после выхода из get_response. Эти запросы досчитываются здесь,
+        # и строка лога пишется, когда тело отдано. В заголовок
+        # Server-Timing и метрики попадает только то, что было до отдачи.
+        try:
+            with capture(timings):
+                yield from content
+        finally:
+            timings.total = time.perf_counter() - timings.started
+            self.log(request, response, timings)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.view_name = view_name(view_func, request)
+
+    @staticmethod
+    def log(request, response, timings):
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request, 'view_name', None),
+            'status': response.status_code,
+            'total_ms': round(timings.total * 1000, 1),
+            'db_ms': round(timings.db * 1000, 1),
+            'queries': timings.queries,
+            'duplicates': timings.duplicates,
+            'serializer_ms': round(timings.serializer * 1000, 1),
+        }
+        slow = []
+        if timings.queries > settings.SLOW_REQUEST_QUERIES:
+            slow.append('queries')
+        if timings.total * 1000 > settings.SLOW_REQUEST_MS:
+            slow.append('time')
+        if not slow:
+            logger.info(json.dumps(record, ensure_ascii=False))
+            return
+        record['slow'] = slow
+        record['repeated'] = timings.repeated()
+        logger.warning(json.dumps(record, ensure_ascii=False))
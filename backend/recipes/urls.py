@@ -1,7 +1,7 @@
 from django.urls import include, path
 from rest_framework.routers import SimpleRouter
 
-from .views import IngredientViewSet, TagViewSet, RecipeViewSet
+from .views import IngredientViewSet, MetricsView, TagViewSet, RecipeViewSet
 
 app_name = 'recipes'
 
@@ -10,4 +10,7 @@ router.register('tags', TagViewSet, basename='tags')
 router.register('ingredients', IngredientViewSet, basename='ingredients')
 router.register('recipes', RecipeViewSet, basename='recipes')
 
-urlpatterns = [path('', include(router.urls))]
+urlpatterns = [
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('', include(router.urls)),
+]
@@ -1,78 +1,140 @@
-from django.db.models import Sum
+from contextlib import nullcontext
+
+from django.db import transaction
+from django.db.models import F
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
-from rest_framework.filters import SearchFilter
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.views import APIView
+
+from . import metrics, similarity
+from .conditional import ConditionalGetMixin
+from .filters import RecipeFilter, RecipeOrderingFilter
+from .paginations import KeysetPagination
+from .ingredient_index import ingredient_index
+from .models import (Recipe, Favorite, RecipeRank, ShoppingCart,
+                     ShoppingListItem, Ingredient, Tag)
+from .permissions import IsAuthenticatedOwnerOrReadOnly, IsStaffOrInternal
+from .renderers import SHOPPING_LIST_RENDERERS
+from .serializers import (RecipeSerializer, CookableSerializer,
+                          FollowRecipeSerializer, IngredientSerializer,
+                          RecipeIdsSerializer, RecipeListSerializer,
+                          SimilarSerializer, TagSerializer)
 
-from .filters import IngredientFilter, RecipeFilter
-from .models import (Recipe, Favorite, ShoppingCart,
-                     IngredientRecipe, Ingredient, Tag)
-from .permissions import IsAuthenticatedOwnerOrReadOnly
-from .serializers import (RecipeSerializer, FollowRecipeSerializer,
-                          IngredientSerializer, TagSerializer)
 
+COUNTER_ORDERING_FIELDS = ('favorites_count', 'in_carts_count')
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+
+class IngredientViewSet(ConditionalGetMixin,
+                        viewsets.ReadOnlyModelViewSet):
+    versioned_content = ('ingredients',)
     queryset = Ingredient.objects.all()
     pagination_class = None
     serializer_class = IngredientSerializer
     permission_classes = (permissions.AllowAny,)
-    filter_backends = (SearchFilter, IngredientFilter)
-    search_fields = ('^name',)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(self.search, request, *args, **kwargs)
+
+    def search(self, request, *args, **kwargs):
+        query = request.query_params.get(
+            'name', request.query_params.get('search', '')
+        )
+        version = self.content_versions.get('ingredients')
+        return Response(ingredient_index.search(
+            query, version.version if version else 0
+        ))
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    versioned_content = ('tags',)
     queryset = Tag.objects.all()
     pagination_class = None
     serializer_class = TagSerializer
     permission_classes = (permissions.AllowAny,)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    versioned_content = ('recipes', 'tags', 'ingredients', 'rankings')
+    per_user_content = ('favorites', 'cart', 'follows')
     serializer_class = RecipeSerializer
+    pagination_class = KeysetPagination
     permission_classes = (IsAuthenticatedOwnerOrReadOnly,)
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('pub_date', *COUNTER_ORDERING_FIELDS)
+    ordering = ('-pub_date',)
+
+    @property
+    def keyset_ordering(self):
+        if self.action in dict(RecipeRank.FEEDS):
+            return ('rank',)
+        if self.action == 'what_to_cook':
+            return ('-coverage', 'missing', '-id')
+        return RecipeOrderingFilter().get_ordering(
+            self.request, self.get_queryset(), self
+        )
+
+    def conditional(self, handler, request, *args, **kwargs):
+        # Порядок по счётчикам меняют действия всех пользователей, а общих
+        # версий избранного и корзины нет, поэтому такие выдачи отдаются
+        # без валидаторов.
+        ordering = {field.lstrip('-') for field in self.keyset_ordering}
+        if ordering & set(COUNTER_ORDERING_FIELDS):
+            return handler(request, *args, **kwargs)
+        return super().conditional(handler, request, *args, **kwargs)
 
     def get_queryset(self):
         author_id = self.request.query_params.get('author')
-        tags = self.request.query_params.getlist('tags')
 
-        queryset = Recipe.objects.all()
+        # Теги, ингредиенты и автора подгружает RecipeListSerializer,
+        # только для рецептов, которых нет в кэше.
+        queryset = Recipe.objects.with_user_flags(self.request.user)
 
         if author_id:
             queryset = queryset.filter(author_id=author_id)
 
-        if tags:
-            queryset = queryset.filter(tags__slug__in=tags)
+        return queryset.order_by('-pub_date', '-id')
 
-        return queryset.order_by('-pub_date')
+    def get_serializer_class(self):
+        if self.request.method in permissions.SAFE_METHODS:
+            return RecipeListSerializer
+        return RecipeSerializer
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     @staticmethod
-    def __favorite_shopping(request, pk, model, errors):
+    def __favorite_shopping(request, pk, model, errors, on_change=None):
+        # Транзакция нужна только корзине: список покупок меняется вместе
+        # с ней. Избранному хватает самой вставки (удаления) и сдвига
+        # счётчика.
+        with transaction.atomic() if on_change else nullcontext():
+            if request.method == 'POST':
+                changed = model.objects.add_one(request.user, pk)
+                sign = 1
+            else:
+                changed = model.objects.remove_one(request.user, pk)
+                sign = -1
+            if changed and on_change:
+                on_change(request.user, [pk], sign)
+
         if request.method == 'POST':
-            if model.objects.filter(user=request.user, recipe__id=pk).exists():
+            if changed is None:
+                get_object_or_404(Recipe.objects.only('id'), id=pk)
                 return Response(
                     {'errors': errors['recipe_in']},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-
-            recipe = get_object_or_404(Recipe, id=pk)
-            model.objects.create(user=request.user, recipe=recipe)
             serializer = FollowRecipeSerializer(
-                recipe, context={'request': request}
+                changed, context={'request': request}
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        recipe = model.objects.filter(user=request.user, recipe__id=pk)
-        if recipe.exists():
-            recipe.delete()
+        if changed:
             return Response(
                 {'msg': 'Успешно удалено'},
                 status=status.HTTP_204_NO_CONTENT
@@ -103,42 +165,185 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return self.__favorite_shopping(request, pk, ShoppingCart, {
             'recipe_in': 'Рецепт уже в списке покупок',
             'recipe_not_in': 'Рецепта нет в списке покупок'
-        })
+        }, on_change=self.__update_shopping_list)
+
+    @staticmethod
+    def __favorite_shopping_bulk(request, model, on_change=None):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+
+        found = set(
+            Recipe.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        current = set(
+            model.objects.filter(user=request.user, recipe_id__in=found)
+            .values_list('recipe_id', flat=True)
+        )
+
+        if request.method == 'POST':
+            changed, done, skipped = found - current, 'added', 'already_in'
+        else:
+            changed, done, skipped = current, 'removed', 'not_in'
+
+        if changed:
+            with transaction.atomic():
+                if request.method == 'POST':
+                    changed = model.objects.add(request.user, changed)
+                else:
+                    changed = model.objects.remove(request.user, changed)
+                if changed and on_change:
+                    on_change(
+                        request.user, changed,
+                        1 if request.method == 'POST' else -1
+                    )
+
+        return Response({'results': [
+            {
+                'id': recipe_id,
+                'status': 'not_found' if recipe_id not in found
+                else done if recipe_id in changed else skipped
+            }
+            for recipe_id in ids
+        ]})
 
     @action(
-        methods=['GET'],
+        methods=['POST', 'DELETE'],
         detail=False,
+        url_path='favorite',
+        url_name='favorite-bulk',
         permission_classes=[permissions.IsAuthenticated]
     )
-    def download_shopping_cart(self, request):
-        ingredients_obj = (
-            IngredientRecipe.objects.filter(recipe__cart__user=request.user)
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(sum_amount=Sum('amount'))
-        )
-        data_dict = {}
-        ingredients_list = []
-
-        for item in ingredients_obj:
-            name = item['ingredient__name'].capitalize()
-            unit = item['ingredient__measurement_unit']
-            sum_amount = item['sum_amount']
-            data_dict[name] = [sum_amount, unit]
-
-        for ind, (key, value) in enumerate(data_dict.items(), 1):
-            ind_str = str(ind).zfill(2)
-            ingredients_list.append(
-                f'{ind_str}. {key} - {value[0]} {value[1]}'
+    def favorite_bulk(self, request):
+        return self.__favorite_shopping_bulk(request, Favorite)
+
+    @action(
+        methods=['POST', 'DELETE'],
+        detail=False,
+        url_path='shopping_cart',
+        url_name='shopping-cart-bulk',
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    def shopping_cart_bulk(self, request):
+        return self.__favorite_shopping_bulk(
+            request, ShoppingCart, on_change=self.__update_shopping_list
+        )
+
+    def __ranked(self, request, feed):
+        # Порядок уже посчитан командой refresh_rankings; здесь только
+        # фильтры ленты и пагинация по месту в подборке.
+        queryset = DjangoFilterBackend().filter_queryset(
+            request, self.get_queryset().ranked(feed), self
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'], detail=False)
+    def popular(self, request):
+        return self.conditional(
+            self.__ranked, request, feed=RecipeRank.POPULAR
+        )
+
+    @action(methods=['GET'], detail=False)
+    def trending(self, request):
+        return self.conditional(
+            self.__ranked, request, feed=RecipeRank.TRENDING
+        )
+
+    def __cookable(self, request):
+        ingredients = [
+            value
+            for values in request.query_params.getlist('ingredients')
+            for value in values.split(',') if value
+        ]
+        params = {'ingredients': ingredients}
+        if 'max_missing' in request.query_params:
+            params['max_missing'] = request.query_params['max_missing']
+        serializer = CookableSerializer(data=params)
+        serializer.is_valid(raise_exception=True)
+
+        queryset = self.get_queryset().cookable(
+            set(serializer.validated_data['ingredients'])
+        )
+        if 'max_missing' in serializer.validated_data:
+            queryset = queryset.filter(
+                missing__lte=serializer.validated_data['max_missing']
             )
+        queryset = DjangoFilterBackend().filter_queryset(
+            request, queryset, self
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'], detail=False)
+    def what_to_cook(self, request):
+        return self.conditional(self.__cookable, request)
+
+    def __similar(self, request, pk):
+        serializer = SimilarSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        recipe = get_object_or_404(
+            Recipe.objects.select_related('signature'), id=pk
+        )
+
+        found = similarity.similar(recipe, serializer.validated_data['limit'])
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in found]
+        )
+        results = []
+        for recipe_id, jaccard, shared_tags in found:
+            if recipe_id in recipes:
+                recipe = recipes[recipe_id]
+                recipe.similarity = {
+                    'jaccard': jaccard, 'shared_tags': shared_tags
+                }
+                results.append(recipe)
+        return Response(self.get_serializer(results, many=True).data)
 
-        filename = 'shopping_list.txt'
-        with open(filename, 'w', encoding='utf-8') as file:
-            file.write('\n'.join(ingredients_list))
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk):
+        return self.conditional(self.__similar, request, pk=pk)
 
-        with open(filename, 'rb') as file:
-            response = HttpResponse(file.read(), content_type='text/plain')
-            response[
-                'Content-Disposition'
-            ] = f'attachment; filename={filename}'
+    @staticmethod
+    def __update_shopping_list(user, recipes, sign):
+        ShoppingListItem.objects.apply_recipes(recipes, [user.id], sign)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=SHOPPING_LIST_RENDERERS
+    )
+    def download_shopping_cart(self, request):
+        ingredients = (
+            ShoppingListItem.objects.filter(user=request.user)
+            .values(
+                'ingredient__name',
+                'ingredient__measurement_unit',
+                sum_amount=F('amount'),
+            )
+            .order_by('ingredient__name')
+        )
+        renderer = request.accepted_renderer
+
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=renderer.content_type
+        )
+        response[
+            'Content-Disposition'
+        ] = f'attachment; filename=shopping_list.{renderer.format}'
 
         return response
+
+
+class MetricsView(APIView):
+    permission_classes = (IsStaffOrInternal,)
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
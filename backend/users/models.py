@@ -89,3 +89,8 @@ class Follow(models.Model):
                 name='unique_user_follow'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=('author', 'user'), name='follow_author_user_idx'
+            )
+        ]
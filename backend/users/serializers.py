@@ -5,23 +5,26 @@ from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
 from .models import User, Follow
+from recipes.relations import get_relations
 from recipes.serializers import FollowRecipeSerializer
+from recipes.timing import TimedSerializerMixin
 
 MAX_FIELD_LENGTH = 150
 
 
-class UserSerializer(serializers.ModelSerializer):
+def get_recipes_limit(request):
+    try:
+        limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return limit if limit >= 0 else None
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, obj):
-        if (
-            'request' not in self.context
-            or self.context['request'].user.is_anonymous
-        ):
-            return False
-        return Follow.objects.filter(
-            author=obj, user=self.context['request'].user
-        ).exists()
+        return get_relations(self.context).is_subscribed(obj.pk)
 
     def validate(self, data):
         password = data.get('password')
@@ -58,28 +61,24 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class FollowListSerializer(serializers.ModelSerializer):
+class FollowListSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(
-        source='recipes.count', read_only=True
-    )
+    recipes_count = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, obj):
-        if self.context['request'].user.is_anonymous:
-            return False
-        return Follow.objects.filter(
-            author=obj, user=self.context['request'].user
-        ).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return get_relations(self.context).is_subscribed(obj.pk)
 
     def get_recipes(self, obj):
         request = self.context['request']
-        limit = request.GET.get('recipes_limit')
-        author = User.objects.get(id=obj.pk)
-        recipes = author.recipes.all()
+        limit = get_recipes_limit(request)
+        recipes = obj.recipes.all()
 
-        if limit:
-            recipes = recipes[:int(limit)]
+        if limit is not None:
+            recipes = recipes[:limit]
 
         serializer = FollowRecipeSerializer(
             recipes,
@@ -89,6 +88,11 @@ class FollowListSerializer(serializers.ModelSerializer):
 
         return serializer.data
 
+    def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+        return obj.recipes.count()
+
     class Meta:
         model = User
         fields = (
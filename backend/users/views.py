@@ -1,3 +1,5 @@
+from django.db.models import Count, F, Prefetch, Value, Window
+from django.db.models.functions import RowNumber
 from django.shortcuts import get_object_or_404
 from rest_framework import permissions, status, generics
 from rest_framework import viewsets
@@ -5,11 +7,14 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from recipes.models import Recipe
+from recipes.paginations import KeysetPagination
 from .models import User, Follow
 from .serializers import (
     FollowListSerializer,
     FollowCreateSerializer,
-    UserSerializer
+    UserSerializer,
+    get_recipes_limit
 )
 
 
@@ -17,10 +22,31 @@ class SubscriptionsView(generics.ListAPIView):
     queryset = User.objects.all()
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = FollowListSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-id',)
 
     def get_queryset(self):
         user = self.request.user
-        return User.objects.filter(following__user=user)
+        recipes = Recipe.objects.order_by('-pub_date', '-id')
+        limit = get_recipes_limit(self.request)
+        if limit is not None:
+            recipes = recipes.annotate(
+                row_number=Window(
+                    RowNumber(),
+                    partition_by=F('author_id'),
+                    order_by=(F('pub_date').desc(), F('id').desc()),
+                )
+            ).filter(row_number__lte=limit)
+
+        return (
+            User.objects.filter(following__user=user)
+            .annotate(
+                recipes_count=Count('recipes', distinct=True),
+                is_subscribed=Value(True),
+            )
+            .prefetch_related(Prefetch('recipes', queryset=recipes))
+            .order_by('-id')
+        )
 
 
 class SubscriptionsViewSet(viewsets.ModelViewSet):